@@ -1,4 +1,5 @@
 import logging
+from agents.tracing import tracer
 
 class Agent:
     """
@@ -30,4 +31,11 @@ class Agent:
         """
         color_code = self.BG_BLACK + self.color
         message = f"[{self.name}] {message}"
-        logging.info(color_code + message + self.RESET)
\ No newline at end of file
+        logging.info(color_code + message + self.RESET)
+
+    def span(self, operation: str, **counters):
+        """
+        Time an operation of this agent with a with block, recording counters such as tokens or cache hits
+        This does nothing unless tracing is enabled
+        """
+        return tracer.span(self.name, operation, **counters)
@@ -0,0 +1,72 @@
+import re
+from typing import List, Dict, Tuple
+from agents.deals import ScrapedDeal
+
+AMOUNT = r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{1,2})?"
+PRICE = re.compile(AMOUNT)
+# "$XXX off", "$XXX discount", "save $XXX", "reduced by $XXX" and the like give a saving, not the price of the product
+DISCOUNT = re.compile(
+    rf"{AMOUNT}\s*(?:off|discount|savings?|less|rebate|credit|gift card|in rewards)\b"
+    rf"|(?:save|saving|reduced by|cut by|drops? by|extra|up to|takes?)\s+{AMOUNT}",
+    re.IGNORECASE)
+
+
+class DealRanker:
+    """
+    A deterministic local scorer for scraped deals, run before the Scanner Agent calls the model
+    It scores the signals that the scanner's prompt asks the model to look for:
+    a clear price that isn't just a "$XXX off" saving, and a detailed description with features
+    Only the top_k deals that have a clear price are sent on to the model
+    Deals with no clear price are rejected; priced deals outside the top_k are deferred, to be ranked again in a later run
+    """
+
+    DETAIL_WORDS = 150
+    FEATURE_WORDS = 80
+
+    def __init__(self, top_k: int = 20):
+        """
+        :param top_k: the most deals to keep
+        """
+        self.top_k = top_k
+
+    @staticmethod
+    def clear_prices(text: str) -> List[float]:
+        """
+        The dollar amounts in this text that aren't part of a discount phrase
+        """
+        savings = {match.span() for match in DISCOUNT.finditer(text)}
+        prices = []
+        for match in PRICE.finditer(text):
+            if any(start <= match.start() and match.end() <= end for start, end in savings):
+                continue
+            prices.append(float(match.group(0).replace('$', '').replace(',', '').strip()))
+        return [price for price in prices if price > 0]
+
+    def score(self, scrape: ScrapedDeal) -> float:
+        """
+        Score a deal between 0 and about 3; 0 means there is no clear price
+        """
+        prices = self.clear_prices(f"{scrape.title} {scrape.summary}")
+        if not prices:
+            prices = self.clear_prices(scrape.details)
+        if not prices:
+            return 0.0
+        detail = min(len(scrape.details.split()), self.DETAIL_WORDS) / self.DETAIL_WORDS
+        features = min(len(scrape.features.split()), self.FEATURE_WORDS) / self.FEATURE_WORDS
+        # A single price is clearer than a title that mentions several amounts
+        clarity = 1.0 if len(set(prices)) == 1 else 0.75
+        return clarity + detail + features
+
+    def rank(self, scraped: List[ScrapedDeal]) -> Tuple[List[ScrapedDeal], List[ScrapedDeal], Dict[str, int]]:
+        """
+        Rank the deals by score and keep the best top_k of those with a clear price
+        :param scraped: the deals to rank
+        :return: the kept deals best first, the rejected deals with no clear price, and statistics for the log
+        """
+        scored = sorted(((self.score(scrape), i, scrape) for i, scrape in enumerate(scraped)), key=lambda t: (-t[0], t[1]))
+        priced = [scrape for score, _, scrape in scored if score > 0]
+        kept = priced[:self.top_k]
+        rejected = [scrape for score, _, scrape in scored if score <= 0]
+        stats = {"scraped": len(scraped), "no_clear_price": len(scraped) - len(priced),
+                 "over_top_k": len(priced) - len(kept), "kept": len(kept)}
+        return kept, rejected, stats
@@ -1,7 +1,6 @@
 from pydantic import BaseModel
-from typing import List, Dict, Self
-from bs4 import BeautifulSoup
-import re
+from typing import List, Dict, Tuple, Self, Optional, Container
+from agents.extraction import extract_summary, extract_details
 import feedparser
 from tqdm import tqdm
 import requests
@@ -19,17 +18,7 @@ def extract(html_snippet: str) -> str:
     """
     Use Beautiful Soup to clean up this HTML snippet and extract useful text
     """
-    soup = BeautifulSoup(html_snippet, 'html.parser')
-    snippet_div = soup.find('div', class_='snippet summary')
-    
-    if snippet_div:
-        description = snippet_div.get_text(strip=True)
-        description = BeautifulSoup(description, 'html.parser').get_text()
-        description = re.sub('<[^<]+?>', '', description)
-        result = description.strip()
-    else:
-        result = html_snippet
-    return result.replace('\n', ' ')
+    return extract_summary(html_snippet)
 
 class ScrapedDeal:
     """
@@ -42,23 +31,27 @@ class ScrapedDeal:
     details: str
     features: str
 
-    def __init__(self, entry: Dict[str, str]):
+    def __init__(self, entry: Dict[str, str], content: Optional[bytes] = None, parsed: Optional[Tuple[str, str]] = None):
         """
         entry: is a dictionary of values
+        content: the detail page, if it has already been downloaded
+        parsed: the (details, features) of the detail page, if it has already been parsed
         Populate this instance based on the provided dict
         """
         self.title = entry['title']
         self.summary = extract(entry['summary'])
-        self.url = entry['links'][0]['href']
-        stuff = requests.get(self.url).content
-        soup = BeautifulSoup(stuff, 'html.parser')
-        content = soup.find('div', class_='content-section').get_text()
-        content = content.replace('\nmore', '').replace('\n', ' ')
-        if "Features" in content:
-            self.details, self.features = content.split("Features")
-        else:
-            self.details = content
-            self.features = ""
+        self.url = self.url_for(entry)
+        if parsed is None:
+            stuff = requests.get(self.url).content if content is None else content
+            parsed = self.parse_page(stuff)
+        self.details, self.features = parsed
+
+    @staticmethod
+    def parse_page(stuff: bytes) -> Tuple[str, str]:
+        """
+        Pull the details and the features out of a deal's detail page
+        """
+        return extract_details(stuff)
 
     def __repr__(self):
         """
@@ -72,16 +65,28 @@ class ScrapedDeal:
         """
         return f"Title: {self.title}\nDetails: {self.details.strip()}\nFeatures: {self.features.strip()}\nURL: {self.url}"
 
+    @staticmethod
+    def url_for(entry: Dict) -> str:
+        """
+        The URL of the detail page for an RSS entry, known before the page is downloaded
+        """
+        return entry['links'][0]['href']
+
     @classmethod
-    def fetch(cls, show_progress : bool = False) -> List[Self]:
+    def fetch(cls, show_progress : bool = False, skip_urls: Optional[Container[str]] = None) -> List[Self]:
         """
         Retrieve all deals from the selected RSS feeds
+        :param show_progress: show a progress bar over the feeds
+        :param skip_urls: URLs of deals that are already known; their detail pages are not downloaded
         """
         deals = []
+        skip_urls = set() if skip_urls is None else skip_urls
         feed_iter = tqdm(feeds) if show_progress else feeds
         for feed_url in feed_iter:
             feed = feedparser.parse(feed_url)
             for entry in feed.entries[:10]:
+                if cls.url_for(entry) in skip_urls:
+                    continue
                 deals.append(cls(entry))
                 time.sleep(0.5)
         return deals
@@ -0,0 +1,123 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict
+import numpy as np
+from agents.tracing import tracer
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+
+class EmbeddingService:
+    """
+    A single SentenceTransformer shared by every Agent in the process, with an LRU cache of vectors keyed by a hash of the text
+    The Frontier Agent and the Random Forest Agent encode the same deal description,
+    so the vector computed for the RAG search is reused for the random forest
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, cache_size: int = 10000):
+        """
+        :param model_name: the SentenceTransformer model to load
+        :param cache_size: the most vectors to keep in the cache
+        """
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.model = None
+        self.cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # Texts that another thread is encoding right now, so that concurrent callers wait for it instead of encoding it again
+        self.pending: Dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the SentenceTransformer the first time it's needed
+        """
+        with self.load_lock:
+            if self.model is None:
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(self.model_name)
+        return self.model
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Return a vector for each text, encoding only the texts that aren't already cached, in a single batch
+        :param texts: the texts to encode
+        :return: a numpy array with one row per text
+        """
+        if not texts:
+            return np.empty((0, self.load().get_sentence_embedding_dimension()))
+        with tracer.span("Embeddings", "encode") as span:
+            result = self._encode(texts, span)
+        return result
+
+    def _encode(self, texts: List[str], span) -> np.ndarray:
+        keys = [self.key_for(text) for text in texts]
+        vectors = {}
+        mine: Dict[str, Future] = {}
+        theirs: Dict[str, Future] = {}
+        with self.lock:
+            for key in keys:
+                if key in vectors or key in mine or key in theirs:
+                    continue
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    vectors[key] = self.cache[key]
+                    self.hits += 1
+                elif key in self.pending:
+                    theirs[key] = self.pending[key]
+                    self.hits += 1
+                else:
+                    mine[key] = self.pending[key] = Future()
+                    self.misses += 1
+        span.add("cache_hits", len(keys) - len(mine))
+        span.add("cache_misses", len(mine))
+        if mine:
+            to_encode = {key: text for key, text in zip(keys, texts) if key in mine}
+            try:
+                encoded = self.load().encode(list(to_encode.values()))
+            except Exception as e:
+                with self.lock:
+                    for key, future in mine.items():
+                        del self.pending[key]
+                        future.set_exception(e)
+                raise
+            with self.lock:
+                for key, vector in zip(to_encode, encoded):
+                    vectors[key] = vector
+                    self.cache[key] = vector
+                    del self.pending[key]
+                    mine[key].set_result(vector)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        for key, future in theirs.items():
+            vectors[key] = future.result()
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self) -> Dict[str, int]:
+        """
+        The cache counters, for logging
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.cache)}
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name: str = MODEL_NAME) -> EmbeddingService:
+    """
+    Return the process-wide EmbeddingService for this model, creating it the first time
+    """
+    with _services_lock:
+        if model_name not in _services:
+            _services[model_name] = EmbeddingService(model_name)
+        return _services[model_name]
@@ -1,3 +1,10 @@
+import os
+import math
+import time
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Tuple, Callable, Optional
+import numpy as np
 import pandas as pd
 from sklearn.linear_model import LinearRegression
 import joblib
@@ -6,24 +13,191 @@ from agents.agent import Agent
 from agents.specialist_agent import SpecialistAgent
 from agents.frontier_agent import FrontierAgent
 from agents.random_forest_agent import RandomForestAgent
+from agents.knn_price_agent import KNNPriceAgent
+from agents.estimate_cache import EstimateCache
+from agents.startup import profile
+
+MEMBERS = ['Specialist', 'Frontier', 'RandomForest']
+# The KNN Price Agent isn't one of the trained members: it stands in for the Frontier Agent when that misses its deadline,
+# since both price a product from the same retrieved neighbours
+FALLBACKS = {'Frontier': 'KNN'}
+
+
+def features_for(members: Tuple[str, ...]) -> List[str]:
+    """
+    The feature columns of the linear model that combines these members
+    Min and Max only add information when there are at least two members
+    """
+    return list(members) + (['Min', 'Max'] if len(members) > 1 else [])
+
+
+def train_fallback_models(X: pd.DataFrame, y: pd.Series) -> Dict[Tuple[str, ...], LinearRegression]:
+    """
+    Train a degraded Linear Regression for every proper subset of the members, to be used when the others miss their deadline
+    :param X: a DataFrame with a column of estimates for each member, as used to train the full ensemble
+    :param y: the true prices
+    :return: a dict from a tuple of member names to the model trained on just their estimates
+    """
+    models = {}
+    for size in range(1, len(MEMBERS)):
+        for members in combinations(MEMBERS, size):
+            data = X[list(members)].copy()
+            data['Min'] = data.min(axis=1)
+            data['Max'] = data.max(axis=1)
+            models[members] = LinearRegression().fit(data[features_for(members)], y)
+    return models
+
+
+def linear_predict(model: LinearRegression, X: np.ndarray) -> np.ndarray:
+    """
+    Apply a fitted Linear Regression to a plain numpy matrix whose columns are in the order it was trained on
+    This is what model.predict does, without the DataFrame that it expects for its feature names
+    """
+    return X @ model.coef_ + model.intercept_
+
 
 class EnsembleAgent(Agent):
 
     name = "Ensemble Agent"
     color = Agent.YELLOW
-    
-    def __init__(self, collection):
+
+    MODEL_FILENAME = 'ensemble_model.pkl'
+    FALLBACK_MODELS_FILENAME = 'ensemble_fallback_models.pkl'
+
+    # Seconds that each member has to return its estimate before the ensemble goes ahead without it
+    DEADLINES = {'Specialist': 60.0, 'Frontier': 30.0, 'RandomForest': 10.0, 'KNN': 5.0}
+    # price_batch allows each member another deadline for every this many descriptions
+    ITEMS_PER_DEADLINE = 8
+
+    def __init__(self, collection, deadlines: Optional[Dict[str, float]] = None, cache: Optional[EstimateCache] = None,
+                 live_collection=None):
         """
         Create an instance of Ensemble, by creating each of the models
         And loading the weights of the Ensemble
+        :param collection: the Chroma collection used by the Frontier Agent
+        :param deadlines: overrides for DEADLINES, by member name
+        :param cache: the cache of members' estimates across runs; defaults to an EstimateCache in the working directory
+        :param live_collection: the Chroma collection of deals priced in earlier runs, also searched by the Frontier Agent
         """
         self.log("Initializing Ensemble Agent")
-        self.specialist = SpecialistAgent()
-        self.frontier = FrontierAgent(collection)
-        self.random_forest = RandomForestAgent()
-        self.model = joblib.load('ensemble_model.pkl')
+        # The members and the ensemble's own models load independently, so load them all at once
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="init") as executor:
+            specialist = executor.submit(profile.timed, "agent", "Specialist Agent", SpecialistAgent)
+            frontier = executor.submit(profile.timed, "agent", "Frontier Agent", FrontierAgent, collection, live_collection=live_collection)
+            random_forest = executor.submit(profile.timed, "agent", "Random Forest Agent", RandomForestAgent)
+            models = executor.submit(profile.timed, "agent", "Ensemble models", self.load_models)
+            self.specialist, self.frontier, self.random_forest = specialist.result(), frontier.result(), random_forest.result()
+            self.model, self.fallback_models = models.result()
+        self.knn = KNNPriceAgent(self.frontier)
+        self.deadlines = {**self.DEADLINES, **(deadlines or {})}
+        self.cache = cache or EstimateCache()
+        # Members that miss a deadline keep running in the background, so leave room for a few of them
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(self.DEADLINES), thread_name_prefix="ensemble")
         self.log("Ensemble Agent is ready")
 
+    def load_models(self) -> Tuple[LinearRegression, Dict[Tuple[str, ...], LinearRegression]]:
+        """
+        Load the Linear Regression that combines all the members, and the fallback models for subsets of them if they've been trained
+        """
+        model = joblib.load(self.MODEL_FILENAME)
+        fallback_models = joblib.load(self.FALLBACK_MODELS_FILENAME) if os.path.exists(self.FALLBACK_MODELS_FILENAME) else {}
+        return model, fallback_models
+
+    def gather(self, calls: Dict[str, Callable], scale: float = 1.0) -> Dict:
+        """
+        Run the calls concurrently and collect the results of those that finish within their member's deadline
+        :param calls: a dict from member name to a function that takes no arguments
+        :param scale: a multiplier for the deadlines, for calls that do more work
+        :return: a dict from member name to result, for the members that succeeded in time
+        """
+        start = time.monotonic()
+        futures = {member: self.executor.submit(call) for member, call in calls.items()}
+        results = {}
+        for member, future in futures.items():
+            deadline = self.deadlines[member] * scale
+            try:
+                results[member] = future.result(timeout=max(0.0, start + deadline - time.monotonic()))
+            except TimeoutError:
+                self.log(f"Ensemble Agent is going ahead without {member}, which missed its {deadline:.0f}s deadline")
+            except Exception as e:
+                self.log(f"Ensemble Agent is going ahead without {member}, which failed: {e}")
+        return results
+
+    def combine(self, estimates: Dict[str, List[float]], count: int) -> Tuple[np.ndarray, List[str]]:
+        """
+        Use the Linear Regression model for whichever members returned estimates
+        If there is no trained model for that combination, use the mean of their estimates
+        :param estimates: a dict from member name to its estimates, one per description
+        :param count: the number of descriptions
+        :return: the combined estimates and the names of the members that contributed to them
+        """
+        estimates = dict(estimates)
+        for member, fallback in FALLBACKS.items():
+            if member not in estimates and fallback in estimates:
+                self.log(f"Ensemble Agent is using the {fallback} estimate in place of {member}")
+                estimates[member] = estimates[fallback]
+        members = tuple(member for member in MEMBERS if member in estimates)
+        if not members:
+            self.log("Ensemble Agent received no estimates in time - returning $0.00")
+            return np.zeros(count), []
+        values = np.column_stack([np.asarray(estimates[member], dtype=float) for member in members])
+        model = self.model if len(members) == len(MEMBERS) else self.fallback_models.get(members)
+        if model is None:
+            return np.maximum(0, values.mean(axis=1)), list(members)
+        if len(members) > 1:
+            values = np.column_stack([values, values.min(axis=1), values.max(axis=1)])
+        return np.maximum(0, linear_predict(model, values)), list(members)
+
+    def estimate(self, descriptions: List[str], single: bool = False) -> Dict[str, List[float]]:
+        """
+        Collect every member's estimates for these descriptions, using the cache where possible
+        and asking members concurrently, within their deadlines, for only the descriptions they haven't priced before
+        :param descriptions: the descriptions of the products
+        :param single: call each member's price rather than price_batch, as there is just one description
+        :return: a dict from member name to its estimates, for the members that have an estimate for every description
+        """
+        with self.span("estimate", items=len(descriptions)) as span:
+            return self._estimate(descriptions, single, span)
+
+    def _estimate(self, descriptions: List[str], single: bool, span) -> Dict[str, List[float]]:
+        cached = self.cache.get_many(descriptions)
+        agents = {'Specialist': self.specialist, 'Frontier': self.frontier, 'RandomForest': self.random_forest, 'KNN': self.knn}
+        todo = {member: [i for i, hit in enumerate(cached) if member not in hit] for member in agents}
+        calls = {}
+        for member, indexes in todo.items():
+            if indexes:
+                agent, texts = agents[member], [descriptions[i] for i in indexes]
+                calls[member] = (lambda agent=agent, texts=texts: [agent.price(texts[0])]) if single else (lambda agent=agent, texts=texts: agent.price_batch(texts))
+        hits = sum(len(descriptions) - len(indexes) for indexes in todo.values())
+        span.add("cache_hits", hits)
+        span.add("cache_misses", len(descriptions) * len(agents) - hits)
+        if hits:
+            self.log(f"Ensemble Agent found {hits} of {len(descriptions) * len(agents)} member estimates in the cache")
+        longest = max((len(indexes) for indexes in todo.values()), default=0)
+        fresh = self.gather(calls, scale=max(1, math.ceil(longest / self.ITEMS_PER_DEADLINE))) if calls else {}
+        span.add("members_missing", len(calls) - len(fresh))
+
+        new_entries = [{} for _ in descriptions]
+        for member, results in fresh.items():
+            for i, result in zip(todo[member], results):
+                cached[i][member] = new_entries[i][member] = float(result)
+        self.cache.put_many(descriptions, new_entries)
+        return {member: [hit[member] for hit in cached] for member in agents if all(member in hit for hit in cached)}
+
+    def price_with_members(self, description: str) -> Tuple[float, List[str]]:
+        """
+        Ask each of the models to price the product concurrently, each within its deadline,
+        then combine the estimates that arrived in time
+        :param description: the description of a product
+        :return: an estimate of its price, and the names of the members that contributed to it
+        """
+        self.log("Running Ensemble Agent - collaborating with specialist, frontier and random forest agents")
+        estimates = self.estimate([description], single=True)
+        y, members = self.combine(estimates, 1)
+        y = float(y[0])
+        self.log(f"Ensemble Agent complete - returning ${y:.2f} from {', '.join(members) or 'no members'}")
+        return y, members
+
     def price(self, description: str) -> float:
         """
         Run this ensemble model
@@ -32,17 +206,19 @@ class EnsembleAgent(Agent):
         :param description: the description of a product
         :return: an estimate of its price
         """
-        self.log("Running Ensemble Agent - collaborating with specialist, frontier and random forest agents")
-        specialist = self.specialist.price(description)
-        frontier = self.frontier.price(description)
-        random_forest = self.random_forest.price(description)
-        X = pd.DataFrame({
-            'Specialist': [specialist],
-            'Frontier': [frontier],
-            'RandomForest': [random_forest],
-            'Min': [min(specialist, frontier, random_forest)],
-            'Max': [max(specialist, frontier, random_forest)],
-        })
-        y = max(0, self.model.predict(X)[0])
-        self.log(f"Ensemble Agent complete - returning ${y:.2f}")
-        return y
\ No newline at end of file
+        return self.price_with_members(description)[0]
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Price many products at once: each member prices the whole batch concurrently with the others,
+        then the Linear Regression model is applied to all of their estimates as a single matrix
+        :param descriptions: the descriptions of the products
+        :return: an estimate of the price of each, in the same order
+        """
+        if not descriptions:
+            return []
+        self.log(f"Running Ensemble Agent on a batch of {len(descriptions)} products")
+        estimates = self.estimate(descriptions)
+        y, members = self.combine(estimates, len(descriptions))
+        self.log(f"Ensemble Agent completed a batch of {len(descriptions)} from {', '.join(members) or 'no members'}")
+        return y.tolist()
@@ -0,0 +1,110 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List
+
+
+STOPWORDS = {"a", "an", "and", "the", "of", "for", "with", "in", "on", "to", "by", "is", "it", "its", "this", "that", "at", "or", "as", "from", "be", "are"}
+
+
+class EstimateCache:
+    """
+    An on-disk cache, in SQLite, of each ensemble member's price estimate for a deal description
+    Descriptions are normalized before hashing, so that lightly rephrased scanner summaries of the same product share a key
+    Entries expire after ttl_seconds, and the oldest are evicted once there are more than max_entries
+    """
+
+    DB_FILENAME = "estimate_cache.db"
+
+    def __init__(self, path: str = DB_FILENAME, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 50000):
+        """
+        :param path: the SQLite database file
+        :param ttl_seconds: how long an estimate stays valid
+        :param max_entries: the most estimates to keep
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS estimates (
+                    key TEXT NOT NULL,
+                    member TEXT NOT NULL,
+                    estimate REAL NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (key, member)
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS estimates_created ON estimates (created)")
+
+    @staticmethod
+    def normalize(description: str) -> str:
+        """
+        Reduce a description to its sorted set of meaningful words and numbers,
+        ignoring case, punctuation, word order and common stopwords
+        """
+        text = unicodedata.normalize("NFKC", description).lower()
+        words = set(re.findall(r"[a-z0-9]+(?:\.[0-9]+)?", text)) - STOPWORDS
+        return " ".join(sorted(words))
+
+    @classmethod
+    def key_for(cls, description: str) -> str:
+        return hashlib.sha256(cls.normalize(description).encode("utf-8")).hexdigest()
+
+    def get_many(self, descriptions: List[str]) -> List[Dict[str, float]]:
+        """
+        Look up the unexpired estimates for each description
+        :param descriptions: the deal descriptions
+        :return: a dict from member name to estimate for each description, empty if nothing is cached
+        """
+        keys = [self.key_for(description) for description in descriptions]
+        found = {key: {} for key in keys}
+        oldest = time.time() - self.ttl_seconds
+        with self.lock:
+            unique = list(found)
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT key, member, estimate FROM estimates WHERE created >= ? AND key IN ({','.join('?' * len(chunk))})",
+                    [oldest, *chunk]).fetchall()
+                for key, member, estimate in rows:
+                    found[key][member] = estimate
+        return [dict(found[key]) for key in keys]
+
+    def get(self, description: str) -> Dict[str, float]:
+        return self.get_many([description])[0]
+
+    def put_many(self, descriptions: List[str], estimates: List[Dict[str, float]]):
+        """
+        Store the members' estimates for each description, then evict what has expired or overflowed
+        :param descriptions: the deal descriptions
+        :param estimates: a dict from member name to estimate, for each description
+        """
+        now = time.time()
+        rows = [(self.key_for(description), member, float(estimate), now)
+                for description, members in zip(descriptions, estimates) for member, estimate in members.items()]
+        if not rows:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO estimates (key, member, estimate, created) VALUES (?, ?, ?, ?)", rows)
+            self._evict(now)
+
+    def put(self, description: str, estimates: Dict[str, float]):
+        self.put_many([description], [estimates])
+
+    def _evict(self, now: float):
+        self.connection.execute("DELETE FROM estimates WHERE created < ?", (now - self.ttl_seconds,))
+        count = self.connection.execute("SELECT COUNT(*) FROM estimates").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM estimates WHERE rowid IN (SELECT rowid FROM estimates ORDER BY created LIMIT ?)",
+                (count - self.max_entries,))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM estimates").fetchone()[0]
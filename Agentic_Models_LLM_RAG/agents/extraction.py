@@ -0,0 +1,49 @@
+import re
+import html
+from typing import Tuple
+from bs4 import BeautifulSoup, SoupStrainer
+
+# lxml builds the tree much faster than the pure-python html.parser, so use it when it's installed
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Only the elements we read are built into a tree; everything else on the page is skipped by the parser
+CONTENT_SECTION = SoupStrainer("div", attrs={"class": "content-section"})
+SNIPPET_SUMMARY = SoupStrainer("div", attrs={"class": "snippet summary"})
+
+TAGS = re.compile(r"<[^<]+?>")
+
+
+def extract_summary(html_snippet: str) -> str:
+    """
+    Clean up the summary HTML of an RSS entry and extract the text of its "snippet summary" div
+    The div is parsed once; any markup left in its text is stripped with a regex rather than a second parse
+    """
+    snippet_div = BeautifulSoup(html_snippet, PARSER, parse_only=SNIPPET_SUMMARY).find("div")
+    if snippet_div:
+        description = snippet_div.get_text(strip=True)
+        if "<" in description or "&" in description:
+            description = TAGS.sub("", html.unescape(TAGS.sub("", description)))
+        result = description.strip()
+    else:
+        result = html_snippet
+    return result.replace("\n", " ")
+
+
+def extract_details(stuff: bytes) -> Tuple[str, str]:
+    """
+    Pull the details and the features out of a deal's detail page, building a tree of just its content-section div
+    :param stuff: the HTML of the detail page
+    :return: a tuple of (details, features), where features is empty if the page has none
+    :raises ValueError: if the page has no content-section div, so the deal is left out as a failed download
+    """
+    content_div = BeautifulSoup(stuff, PARSER, parse_only=CONTENT_SECTION).find("div")
+    if content_div is None:
+        raise ValueError("The page has no content-section div")
+    content = content_div.get_text()
+    content = content.replace("\nmore", "").replace("\n", " ")
+    details, _, features = content.partition("Features")
+    return details, features
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import List, Dict, Tuple, Optional, Container
+from urllib.parse import urlsplit
+import feedparser
+import httpx
+
+from agents.deals import ScrapedDeal, feeds
+from agents.http_cache import HttpCache
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter for asyncio: up to capacity requests at once, refilled at rate requests per second
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until a token is available, then take it
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncDealFetcher:
+    """
+    Fetches the RSS feeds and the detail page of each deal concurrently, over a pooled HTTP client
+    Requests are limited per host by a token bucket and overall by a semaphore,
+    and retried with exponential backoff on timeouts, connection errors and 429/5xx responses
+    With an HttpCache, requests are conditional, and unchanged detail pages are not parsed again
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, feed_urls: Optional[List[str]] = None, entries_per_feed: int = 10, rate_per_host: float = 5.0,
+                 burst: int = 5, max_concurrency: int = 8, timeout: float = 10.0, retries: int = 3, backoff: float = 0.5,
+                 cache: Optional[HttpCache] = None):
+        """
+        :param feed_urls: the RSS feeds to read; defaults to the dealnews feeds
+        :param entries_per_feed: how many entries to take from each feed
+        :param rate_per_host: the most requests per second to send to any one host
+        :param burst: how many requests to a host may be sent at once before the rate applies
+        :param max_concurrency: the most requests in flight at once
+        :param timeout: seconds before a request is abandoned
+        :param retries: how many times to retry a failed request
+        :param backoff: seconds to wait before the first retry, doubling after each one
+        :param cache: an HttpCache for conditional requests and parsed pages, or None to always download and parse
+        """
+        self.feed_urls = feed_urls or feeds
+        self.entries_per_feed = entries_per_feed
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.failures = 0
+        self.feed_failures = 0
+        self.not_modified = 0
+
+    def make_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        return httpx.AsyncClient(timeout=self.timeout, limits=limits, follow_redirects=True)
+
+    async def get(self, client: httpx.AsyncClient, url: str, buckets: Dict[str, TokenBucket], semaphore: asyncio.Semaphore,
+                  headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """
+        GET this URL within the rate limits, retrying transient failures
+        A 304 Not Modified response is returned as it is
+        """
+        host = urlsplit(url).netloc
+        bucket = buckets.setdefault(host, TokenBucket(self.rate_per_host, self.burst))
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            try:
+                async with semaphore:
+                    response = await client.get(url, headers=headers)
+                if response.status_code == 304:
+                    return response
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = httpx.HTTPStatusError(f"{response.status_code} from {url}", request=response.request, response=response)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    async def get_content(self, client, url: str, buckets, semaphore) -> Tuple[bytes, Optional[str]]:
+        """
+        Return the body of this URL and a hash of it, using a conditional request when it's in the cache
+        The hash is None when there is no cache
+        """
+        if not self.cache:
+            response = await self.get(client, url, buckets, semaphore)
+            return response.content, None
+        response = await self.get(client, url, buckets, semaphore, headers=self.cache.conditional_headers(url))
+        if response.status_code == 304:
+            cached = self.cache.not_modified(url)
+            if cached:
+                self.not_modified += 1
+                return cached
+            response = await self.get(client, url, buckets, semaphore)
+        content_hash = self.cache.store(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.content, content_hash
+
+    async def fetch_entries(self, client, buckets, semaphore) -> List[Dict]:
+        """
+        Read all the feeds concurrently and return their entries, in feed order
+        A feed that can't be read is logged and counted in feed_failures, and its deals are left out
+        """
+        async def fetch_feed(feed_url):
+            content, _ = await self.get_content(client, feed_url, buckets, semaphore)
+            return feedparser.parse(content).entries[:self.entries_per_feed]
+        results = await asyncio.gather(*[fetch_feed(feed_url) for feed_url in self.feed_urls], return_exceptions=True)
+        entries = []
+        for feed_url, result in zip(self.feed_urls, results):
+            if isinstance(result, BaseException):
+                self.feed_failures += 1
+                logging.warning(f"Could not read the feed {feed_url}: {result!r}")
+            else:
+                entries.extend(result)
+        return entries
+
+    async def fetch(self, skip_urls: Optional[Container[str]] = None) -> List[ScrapedDeal]:
+        """
+        Retrieve all deals from the feeds, downloading the detail pages of those not in skip_urls concurrently
+        Deals whose detail page can't be downloaded or parsed are left out
+        :param skip_urls: URLs of deals that are already known
+        :return: the deals, in feed order
+        """
+        skip_urls = set() if skip_urls is None else skip_urls
+        self.not_modified = 0
+        self.feed_failures = 0
+        buckets: Dict[str, TokenBucket] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.make_client() as client:
+            entries = await self.fetch_entries(client, buckets, semaphore)
+            entries = [entry for entry in entries if ScrapedDeal.url_for(entry) not in skip_urls]
+
+            async def fetch_deal(entry):
+                url = ScrapedDeal.url_for(entry)
+                content, content_hash = await self.get_content(client, url, buckets, semaphore)
+                parsed = self.cache.get_parsed(url, content_hash) if self.cache else None
+                deal = ScrapedDeal(entry, content=content, parsed=parsed)
+                if self.cache and parsed is None:
+                    self.cache.put_parsed(url, content_hash, (deal.details, deal.features))
+                return deal
+            results = await asyncio.gather(*[fetch_deal(entry) for entry in entries], return_exceptions=True)
+        deals = [result for result in results if not isinstance(result, BaseException)]
+        self.failures = len(results) - len(deals)
+        return deals
+
+
+def run_sync(coroutine):
+    """
+    Run a coroutine to completion from synchronous code
+    If this thread already has a running event loop, as in a Jupyter notebook, run it on a separate thread
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
@@ -4,14 +4,12 @@ import os
 import re
 import math
 import json
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple
 from openai import OpenAI
-from sentence_transformers import SentenceTransformer
-from datasets import load_dataset
-import chromadb
-from items import Item
-from testing import Tester
 from agents.agent import Agent
+from agents.embeddings import get_embedding_service
+from agents.vector_index import get_retrieval_backend, within_distance, ChromaBackend, Neighbours
 
 
 class FrontierAgent(Agent):
@@ -20,11 +18,21 @@ class FrontierAgent(Agent):
     color = Agent.BLUE
 
     MODEL = "gpt-4o-mini"
+
+    # How many calls to the frontier model price_batch makes at the same time
+    MAX_WORKERS = 8
     
-    def __init__(self, collection):
+    def __init__(self, collection, index=None, live_collection=None, quantization=None):
         """
         Set up this instance by connecting to OpenAI or DeepSeek, to the Chroma Datastore,
         And setting up the vector encoding model
+        :param collection: the Chroma collection of products
+        :param index: the retrieval backend to find similar products with; defaults to the memory-mapped IVFIndex
+        if one has been built with build_vector_index.py, otherwise the Chroma collection
+        :param live_collection: a Chroma collection of deals priced in earlier runs, searched as well as the index;
+        their prices are sale prices, so they're shown to the model as past deals rather than as similar products
+        :param quantization: "int8" or "binary" to search the IVFIndex through its quantized copy;
+        defaults to the VECTOR_QUANTIZATION environment variable
         """
         self.log("Initializing Frontier Agent")
         deepseek_api_key = os.getenv("DEEPSEEK_API_KEY")
@@ -37,32 +45,44 @@ class FrontierAgent(Agent):
             self.MODEL = "gpt-4o-mini"
             self.log("Frontier Agent is setting up with OpenAI")
         self.collection = collection
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.index = index or get_retrieval_backend(collection, quantization=quantization)
+        self.live = ChromaBackend(live_collection) if live_collection is not None else None
+        self.log(f"Frontier Agent is retrieving similar products with {type(self.index).__name__}"
+                 + (f" through its {self.index.quantization} copy" if getattr(self.index, "quantization", None) else ""))
+        self.model = get_embedding_service()
+        self.model.load()
         self.log("Frontier Agent is ready")
 
-    def make_context(self, similars: List[str], prices: List[float]) -> str:
+    def make_context(self, similars: List[str], prices: List[float], deals: Tuple[List[str], List[float]] = ([], [])) -> str:
         """
         Create context that can be inserted into the prompt
         :param similars: similar products to the one being estimated
         :param prices: prices of the similar products
+        :param deals: the descriptions and sale prices of similar deals seen in earlier runs
         :return: text to insert in the prompt that provides context
         """
         message = "To provide some context, here are some other items that might be similar to the item you need to estimate.\n\n"
         for similar, price in zip(similars, prices):
             message += f"Potentially related product:\n{similar}\nPrice is ${price:.2f}\n\n"
+        if deals[0]:
+            message += "These similar items were recently on sale; their sale prices are below what they usually cost.\n\n"
+            for deal, price in zip(*deals):
+                message += f"Past deal:\n{deal}\nSale price was ${price:.2f}\n\n"
         return message
 
-    def messages_for(self, description: str, similars: List[str], prices: List[float]) -> List[Dict[str, str]]:
+    def messages_for(self, description: str, similars: List[str], prices: List[float],
+                     deals: Tuple[List[str], List[float]] = ([], [])) -> List[Dict[str, str]]:
         """
         Create the message list to be included in a call to OpenAI
         With the system and user prompt
         :param description: a description of the product
         :param similars: similar products to this one
         :param prices: prices of similar products
+        :param deals: the descriptions and sale prices of similar past deals
         :return: the list of messages in the format expected by OpenAI
         """
         system_message = "You estimate prices of items. Reply only with the price, no explanation"
-        user_prompt = self.make_context(similars, prices)
+        user_prompt = self.make_context(similars, prices, deals)
         user_prompt += "And now the question for you:\n\n"
         user_prompt += "How much does this cost?\n\n" + description
         return [
@@ -76,13 +96,52 @@ class FrontierAgent(Agent):
         Return a list of items similar to the given one by looking in the Chroma datastore
         """
         self.log("Frontier Agent is performing a RAG search of the Chroma datastore to find 5 similar products")
-        vector = self.model.encode([description])
-        results = self.collection.query(query_embeddings=vector.astype(float).tolist(), n_results=5)
-        documents = results['documents'][0][:]
-        prices = [m['price'] for m in results['metadatas'][0][:]]
+        documents, prices = self.find_similars_batch([description])[0]
         self.log("Frontier Agent has found similar products")
         return documents, prices
 
+    def find_similars_batch(self, descriptions: List[str]) -> List[Tuple[List[str], List[float]]]:
+        """
+        Look up the items similar to each description with one encode and one batched query of the retrieval backend
+        :param descriptions: descriptions of the products
+        :return: a (documents, prices) tuple for each description, in the same order
+        """
+        return [(documents, prices) for documents, prices, _ in self.neighbours_batch(descriptions)]
+
+    def neighbours_batch(self, descriptions: List[str], k: int = 5) -> List[Neighbours]:
+        """
+        The k nearest products to each description from the retrieval backend, without the live deals,
+        whose prices are sale prices rather than what the products usually cost
+        :param descriptions: descriptions of the products
+        :return: the documents, prices and distances of the neighbours of each description, closest first
+        """
+        return self.products_for(self.model.encode(descriptions), k)
+
+    def products_for(self, vectors, k: int = 5) -> List[Neighbours]:
+        """
+        The k nearest products to each of these vectors, from the retrieval backend only
+        """
+        with self.span("retrieval", queries=len(vectors)):
+            return self.index.query(vectors, k=k)
+
+    def retrieve(self, descriptions: List[str], k: int = 5) -> Tuple[List[Neighbours], List[Neighbours]]:
+        """
+        Find the k nearest products to each description, and the live deals that are closer than the farthest of them
+        Both use one encode of the descriptions
+        :param descriptions: descriptions of the products
+        :return: the neighbouring products and the neighbouring live deals of each description, closest first
+        """
+        vectors = self.model.encode(descriptions)
+        products = self.products_for(vectors, k)
+        deals = [([], [], []) for _ in descriptions]
+        live_count = len(self.live) if self.live is not None else 0
+        if live_count:
+            with self.span("live_retrieval", queries=len(descriptions)):
+                live = self.live.query(vectors, k=min(k, live_count))
+            deals = [within_distance(found, product[2][-1] if product[2] else float("inf"))
+                     for product, found in zip(products, live)]
+        return products, deals
+
     def get_price(self, s) -> float:
         """
         A utility that plucks a floating point number out of a string
@@ -91,6 +150,25 @@ class FrontierAgent(Agent):
         match = re.search(r"[-+]?\d*\.\d+|\d+", s)
         return float(match.group()) if match else 0.0
 
+    def price_with_context(self, description: str, documents: List[str], prices: List[float],
+                           deals: Tuple[List[str], List[float]] = ([], [])) -> float:
+        """
+        Make a call to OpenAI or DeepSeek to estimate the price of the described product, given similar products
+        and any similar past deals
+        """
+        with self.span("call_model") as span:
+            response = self.client.chat.completions.create(
+                model=self.MODEL, 
+                messages=self.messages_for(description, documents, prices, deals),
+                seed=42,
+                max_tokens=5
+            )
+            if response.usage:
+                span.add("input_tokens", response.usage.prompt_tokens)
+                span.add("output_tokens", response.usage.completion_tokens)
+        reply = response.choices[0].message.content
+        return self.get_price(reply)
+
     def price(self, description: str) -> float:
         """
         Make a call to OpenAI or DeepSeek to estimate the price of the described product,
@@ -98,16 +176,27 @@ class FrontierAgent(Agent):
         :param description: a description of the product
         :return: an estimate of the price
         """
-        documents, prices = self.find_similars(description)
-        self.log(f"Frontier Agent is about to call {self.MODEL} with context including 5 similar products")
-        response = self.client.chat.completions.create(
-            model=self.MODEL, 
-            messages=self.messages_for(description, documents, prices),
-            seed=42,
-            max_tokens=5
-        )
-        reply = response.choices[0].message.content
-        result = self.get_price(reply)
+        self.log("Frontier Agent is performing a RAG search of the Chroma datastore to find 5 similar products")
+        products, deals = self.retrieve([description])
+        (documents, prices, _), (deals, deal_prices, _) = products[0], deals[0]
+        self.log(f"Frontier Agent is about to call {self.MODEL} with context including 5 similar products and {len(deals)} past deals")
+        result = self.price_with_context(description, documents, prices, (deals, deal_prices))
         self.log(f"Frontier Agent completed - predicting ${result:.2f}")
         return result
-        
\ No newline at end of file
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of many products: one RAG search for all of them,
+        then calls to the frontier model running MAX_WORKERS at a time
+        :param descriptions: descriptions of the products
+        :return: an estimate of the price of each, in the same order
+        """
+        self.log(f"Frontier Agent is performing a RAG search for a batch of {len(descriptions)} products")
+        products, deals = self.retrieve(descriptions)
+        self.log(f"Frontier Agent is about to call {self.MODEL} for a batch of {len(descriptions)} products")
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            results = list(executor.map(lambda args: self.price_with_context(*args),
+                                        [(description, documents, prices, (past, past_prices))
+                                         for description, (documents, prices, _), (past, past_prices, _) in zip(descriptions, products, deals)]))
+        self.log(f"Frontier Agent completed a batch of {len(results)} predictions")
+        return results
@@ -0,0 +1,96 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class HttpCache:
+    """
+    An on-disk cache, in SQLite, for the deal feeds and detail pages
+    It keeps each response body with its ETag and Last-Modified headers, to make conditional requests,
+    and the parsed (details, features) of each detail page keyed by URL and content hash,
+    so that an unchanged page is neither downloaded nor parsed again
+    """
+
+    DB_FILENAME = "http_cache.db"
+
+    def __init__(self, path: str = DB_FILENAME, max_age_seconds: float = 7 * 24 * 3600):
+        """
+        :param path: the SQLite database file
+        :param max_age_seconds: entries not refreshed for this long are removed when the cache is opened
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content BLOB NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    fetched REAL NOT NULL
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS deals (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    details TEXT NOT NULL,
+                    features TEXT NOT NULL
+                )""")
+            oldest = time.time() - max_age_seconds
+            self.connection.execute("DELETE FROM deals WHERE url IN (SELECT url FROM responses WHERE fetched < ?)", (oldest,))
+            self.connection.execute("DELETE FROM responses WHERE fetched < ?", (oldest,))
+
+    @staticmethod
+    def hash_for(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """
+        The If-None-Match and If-Modified-Since headers for a request to this URL, if it has been fetched before
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers["If-None-Match"] = row[0]
+        if row and row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def not_modified(self, url: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Record that the server says this URL hasn't changed, and return its cached (content, content_hash)
+        """
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE responses SET fetched = ? WHERE url = ?", (time.time(), url))
+            row = self.connection.execute("SELECT content, content_hash FROM responses WHERE url = ?", (url,)).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def store(self, url: str, content: bytes, etag: Optional[str], last_modified: Optional[str]) -> str:
+        """
+        Store a fresh response and return the hash of its content
+        """
+        content_hash = self.hash_for(content)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, content, content_hash, fetched) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content, content_hash, time.time()))
+        return content_hash
+
+    def get_parsed(self, url: str, content_hash: str) -> Optional[Tuple[str, str]]:
+        """
+        The (details, features) parsed from this exact version of the page, if it has been parsed before
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT details, features FROM deals WHERE url = ? AND content_hash = ?", (url, content_hash)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put_parsed(self, url: str, content_hash: str, parsed: Tuple[str, str]):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO deals (url, content_hash, details, features) VALUES (?, ?, ?, ?)",
+                                    (url, content_hash, *parsed))
@@ -0,0 +1,61 @@
+from typing import List
+import numpy as np
+from agents.agent import Agent
+from agents.frontier_agent import FrontierAgent
+
+
+class KNNPriceAgent(Agent):
+    """
+    Estimates a price straight from the nearest products that the Frontier Agent retrieves, without calling a model:
+    the median of their prices, weighted by how similar each one is
+    A weighted median is robust to the odd neighbour with a wildly different price, where a weighted mean is not
+    It shares the Frontier Agent's retrieval backend and embedding cache, so it costs a lookup and no network
+    Live deals are left out: their prices are sale prices, and a deal seen again would otherwise be priced at its own sale price
+    """
+
+    name = "KNN Price Agent"
+    color = Agent.CYAN
+
+    NEIGHBOURS = 5
+
+    def __init__(self, frontier: FrontierAgent):
+        """
+        :param frontier: the Frontier Agent whose retrieval this reuses
+        """
+        self.log("KNN Price Agent is initializing")
+        self.frontier = frontier
+        self.log("KNN Price Agent is ready")
+
+    @staticmethod
+    def weighted_median(prices: List[float], distances: List[float]) -> float:
+        """
+        The price at which the neighbours' similarity weights, 1 / (1 + distance), reach half their total
+        :param prices: the prices of the neighbours
+        :param distances: their distances from the product being priced
+        :return: the estimate, or 0 if there are no neighbours
+        """
+        if not prices:
+            return 0.0
+        prices = np.asarray(prices, dtype=float)
+        weights = 1.0 / (1.0 + np.asarray(distances, dtype=float))
+        order = np.argsort(prices)
+        cumulative = np.cumsum(weights[order])
+        return float(prices[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+    def price(self, description: str) -> float:
+        """
+        Estimate the price of the described item from its nearest neighbours
+        """
+        return self.price_batch([description])[0]
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of many items with one batched retrieval
+        :param descriptions: the products to be estimated
+        :return: the prices as a list of floats, in the same order
+        """
+        self.log(f"KNN Price Agent is estimating {len(descriptions)} prices from their nearest neighbours")
+        neighbours = self.frontier.neighbours_batch(descriptions, k=self.NEIGHBOURS)
+        results = [self.weighted_median(prices, distances) for _, prices, distances in neighbours]
+        self.log(f"KNN Price Agent completed a batch of {len(results)} estimates")
+        return results
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+from typing import Dict
+from agents.deals import Opportunity
+from agents.embeddings import get_embedding_service
+
+
+class LiveDealStore:
+    """
+    Writes the deals that the Planning Agent prices into a separate "live" Chroma collection,
+    so that they become retrieval context for the Frontier Agent alongside the products in the datastore
+    Deals are buffered and upserted in batches, keyed by a hash of their URL, so a deal seen twice is stored once
+    Their vectors come from the shared EmbeddingService, which has usually encoded them already while pricing them
+    The price stored with each is its sale price, not what the product usually costs, so the Frontier Agent presents
+    these as past deals rather than as similar products, and the KNN Price Agent ignores them
+    """
+
+    COLLECTION_NAME = "live_deals"
+    CATEGORY = "Live"
+
+    def __init__(self, client, batch_size: int = 20):
+        """
+        :param client: the Chroma client of the datastore
+        :param batch_size: how many deals to buffer before upserting them
+        """
+        self.collection = client.get_or_create_collection(self.COLLECTION_NAME)
+        self.batch_size = batch_size
+        self.pending: Dict[str, Opportunity] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def id_for(url: str) -> str:
+        return "live_" + hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+    def add(self, opportunity: Opportunity):
+        """
+        Buffer a priced deal, upserting the buffer once it holds batch_size deals
+        """
+        with self.lock:
+            self.pending[opportunity.deal.url] = opportunity
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Upsert every buffered deal in one call
+        :return: the number of deals written
+        """
+        with self.lock:
+            opportunities = list(self.pending.values())
+            self.pending = {}
+        if not opportunities:
+            return 0
+        documents = [opportunity.deal.product_description for opportunity in opportunities]
+        vectors = get_embedding_service().encode(documents)
+        self.collection.upsert(
+            ids=[self.id_for(opportunity.deal.url) for opportunity in opportunities],
+            documents=documents,
+            embeddings=vectors,
+            metadatas=[{"category": self.CATEGORY, "price": opportunity.deal.price, "url": opportunity.deal.url,
+                        "estimate": opportunity.estimate, "source": "live"} for opportunity in opportunities],
+        )
+        return len(opportunities)
+
+    def __len__(self) -> int:
+        return self.collection.count()
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Iterator, List, Union
+from agents.deals import Opportunity
+
+
+class OpportunityStore:
+    """
+    The memory of the Agent Framework: every Opportunity surfaced so far, in an append-only SQLite table
+    The deal URL is indexed, so checking whether a deal has been surfaced before is a single lookup,
+    and appending an Opportunity writes just that row rather than rewriting the whole history
+    Opportunities are only parsed back into pydantic objects when they are read
+    """
+
+    DB_FILENAME = "opportunities.db"
+    LEGACY_FILENAME = "memory.json"
+
+    def __init__(self, path: str = DB_FILENAME, legacy_path: str = LEGACY_FILENAME):
+        """
+        :param path: the SQLite database file
+        :param legacy_path: a memory.json file to import the first time the store is opened
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS opportunities (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL UNIQUE,
+                    opportunity TEXT NOT NULL,
+                    created REAL NOT NULL
+                )""")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.import_legacy(legacy_path)
+
+    def import_legacy(self, legacy_path: str) -> int:
+        """
+        A one-time import of the opportunities in a memory.json file, in their original order
+        The file is left in place; the import is recorded so that it isn't repeated
+        :return: the number of opportunities imported
+        """
+        if not legacy_path or not os.path.exists(legacy_path):
+            return 0
+        key = f"imported:{os.path.abspath(legacy_path)}"
+        with self.lock:
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+                return 0
+        with open(legacy_path, "r") as file:
+            data = json.load(file)
+        opportunities = [Opportunity(**item) for item in data]
+        imported = self.extend(opportunities)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(time.time())))
+        return imported
+
+    def extend(self, opportunities: List[Opportunity]) -> int:
+        """
+        Append these opportunities in a single transaction, ignoring any whose URL is already stored
+        :return: the number of opportunities appended
+        """
+        now = time.time()
+        rows = [(opportunity.deal.url, opportunity.model_dump_json(), now) for opportunity in opportunities]
+        with self.lock, self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO opportunities (url, opportunity, created) VALUES (?, ?, ?)", rows)
+            return self.connection.total_changes - before
+
+    def append(self, opportunity: Opportunity):
+        self.extend([opportunity])
+
+    def has_url(self, url: str) -> bool:
+        """
+        Whether an Opportunity for this deal URL has been surfaced before
+        """
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM opportunities WHERE url = ?", (url,)).fetchone() is not None
+
+    def __contains__(self, url: str) -> bool:
+        return self.has_url(url)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM opportunities").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Opportunity]:
+        with self.lock:
+            rows = self.connection.execute("SELECT opportunity FROM opportunities ORDER BY id").fetchall()
+        for (row,) in rows:
+            yield Opportunity.model_validate_json(row)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Opportunity, List[Opportunity]]:
+        """
+        The Opportunity at this position in the order they were surfaced, as if the store were a list
+        """
+        if isinstance(index, slice):
+            return list(self)[index]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("opportunity index out of range")
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT opportunity FROM opportunities ORDER BY id LIMIT 1 OFFSET ?", (index,)).fetchone()
+        return Opportunity.model_validate_json(row[0])
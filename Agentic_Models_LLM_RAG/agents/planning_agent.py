@@ -1,9 +1,13 @@
-from typing import Optional, List
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple
 from agents.agent import Agent
 from agents.deals import ScrapedDeal, DealSelection, Deal, Opportunity
 from agents.scanner_agent import ScannerAgent
 from agents.ensemble_agent import EnsembleAgent
 from agents.messaging_agent import MessagingAgent
+from agents.startup import profile
 
 
 class PlanningAgent(Agent):
@@ -12,15 +16,25 @@ class PlanningAgent(Agent):
     color = Agent.GREEN
     NUM_DEALS_SELECTION = 5
     DEAL_THRESHOLD = 50
+    # Deals stream from the scanner onto a queue of this size, and this many workers price them concurrently
+    QUEUE_SIZE = 5
+    PRICING_WORKERS = 3
 
-    def __init__(self, collection):
+    def __init__(self, collection, live_store=None):
         """
         Create instances of the 3 Agents that this planner coordinates across
+        They don't depend on each other, so they are initialized concurrently
+        :param collection: the Chroma collection of products
+        :param live_store: an optional LiveDealStore that every priced deal is written back to, for future retrieval
         """
         self.log("Planning Agent is initializing")
-        self.scanner = ScannerAgent()
-        self.ensemble = EnsembleAgent(collection) #this instantiates are three pricing agents that collaborate to predict the price
-        self.messenger = MessagingAgent()
+        self.live_store = live_store
+        live_collection = live_store.collection if live_store else None
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="init") as executor:
+            scanner = executor.submit(profile.timed, "agent", "Scanner Agent", ScannerAgent)
+            ensemble = executor.submit(profile.timed, "agent", "Ensemble Agent", EnsembleAgent, collection, live_collection=live_collection) #this instantiates are three pricing agents that collaborate to predict the price
+            messenger = executor.submit(profile.timed, "agent", "Messaging Agent", MessagingAgent)
+            self.scanner, self.ensemble, self.messenger = scanner.result(), ensemble.result(), messenger.result()
         self.log("Planning Agent is ready")
 
     def run(self, deal: Deal) -> Opportunity:
@@ -35,24 +49,108 @@ class PlanningAgent(Agent):
         self.log(f"Planning Agent has processed a deal with discount ${discount:.2f}")
         return Opportunity(deal=deal, estimate=estimate, discount=discount)
 
+    def run_batch(self, deals: List[Deal]) -> List[Opportunity]:
+        """
+        Run the workflow for several deals, pricing them with one batch call to the ensemble
+        :param deals: the deals, summarized from an RSS scrape
+        :returns: an opportunity for each deal, in the same order
+        """
+        if len(deals) == 1:
+            return [self.run(deals[0])]
+        self.log(f"Planning Agent is pricing up {len(deals)} potential deals in one batch")
+        estimates = self.ensemble.price_batch([deal.product_description for deal in deals])
+        return [Opportunity(deal=deal, estimate=estimate, discount=estimate - deal.price) for deal, estimate in zip(deals, estimates)]
+
     def plan(self, memory: List[str] = []) -> Optional[Opportunity]:
         """
-        Run the full workflow:
-        1. Use the ScannerAgent to find deals from RSS feeds
-        2. Use the EnsembleAgent to estimate them
-        3. Use the MessagingAgent to send a notification of deals
-        :param memory: a list of URLs that have been surfaced in the past
+        Run the full workflow as a streaming pipeline:
+        1. Use the ScannerAgent to find deals from RSS feeds, putting each on a queue as soon as it's parsed
+        2. Use the EnsembleAgent to estimate them, with a pool of workers consuming the queue;
+           each worker takes every deal waiting on the queue and prices them as one batch
+        3. Use the MessagingAgent to send a notification for the best deal, once every deal has been priced,
+           if it clears the threshold
+        :param memory: the opportunities surfaced in the past, as an OpportunityStore or a list
         :return: an Opportunity if one was surfaced, otherwise None
         """
         self.log("Planning Agent is kicking off a run")
-        selection = self.scanner.scan(memory=memory)
-        if selection:
-            opportunities = [self.run(deal) for deal in selection.deals[:self.NUM_DEALS_SELECTION]]
-            opportunities.sort(key=lambda opp: opp.discount, reverse=True)
-            best = opportunities[0]
-            self.log(f"Planning Agent has identified the best deal has discount ${best.discount:.2f}")
-            if best.discount > self.DEAL_THRESHOLD:
+        with self.span("plan") as span:
+            best = self._plan(memory, span)
+        if best is None:
+            return None
+        self.log(f"Planning Agent has identified the best deal has discount ${best.discount:.2f}")
+        if best.discount > self.DEAL_THRESHOLD:
+            try:
                 self.messenger.alert(best)
-            self.log("Planning Agent has completed a run")
-            return best if best.discount > self.DEAL_THRESHOLD else None
-        return None
\ No newline at end of file
+            except Exception as e:
+                self.log(f"Planning Agent could not send an alert: {e}")
+        self.log("Planning Agent has completed a run")
+        return best if best.discount > self.DEAL_THRESHOLD else None
+
+    def _plan(self, memory, span) -> Optional[Opportunity]:
+        """
+        Stream deals from the scanner to the pricing workers
+        :return: the best Opportunity priced, whether or not it clears the threshold
+        """
+        deals = queue.Queue(maxsize=self.QUEUE_SIZE)
+        lock = threading.Lock()
+        state = {"best": None}
+
+        def next_batch() -> Tuple[List[Deal], bool]:
+            """
+            Wait for a deal, then take every other deal already waiting, stopping at this worker's None
+            :return: the deals, and whether the None that ends this worker was taken
+            """
+            batch = [deals.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(deals.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                return batch[:-1], True
+            return batch, False
+
+        def price_deals():
+            finished = False
+            while not finished:
+                batch, finished = next_batch()
+                if not batch:
+                    continue
+                try:
+                    opportunities = self.run_batch(batch)
+                except Exception as e:
+                    self.log(f"Planning Agent could not price {len(batch)} deals: {e}")
+                    continue
+                for opportunity in opportunities:
+                    if self.live_store:
+                        try:
+                            self.live_store.add(opportunity)
+                        except Exception as e:
+                            self.log(f"Planning Agent could not write a deal back to the live store: {e}")
+                    with lock:
+                        if state["best"] is None or opportunity.discount > state["best"].discount:
+                            state["best"] = opportunity
+                        span.add("deals_priced")
+
+        workers = [threading.Thread(target=price_deals, name=f"pricer-{i}") for i in range(self.PRICING_WORKERS)]
+        for worker in workers:
+            worker.start()
+        try:
+            # Read the stream to the end, rather than stopping after NUM_DEALS_SELECTION deals,
+            # so the scanner records the token usage and seen URLs that it only has once the response is complete
+            for count, deal in enumerate(self.scanner.scan_stream(memory=memory)):
+                if count < self.NUM_DEALS_SELECTION:
+                    deals.put(deal)
+        finally:
+            for _ in workers:
+                deals.put(None)
+            for worker in workers:
+                worker.join()
+            if self.live_store:
+                try:
+                    written = self.live_store.flush()
+                    span.add("live_deals_written", written)
+                except Exception as e:
+                    self.log(f"Planning Agent could not write deals back to the live store: {e}")
+
+        return state["best"]
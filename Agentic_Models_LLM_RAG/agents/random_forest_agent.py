@@ -3,9 +3,9 @@
 import os
 import re
 from typing import List
-from sentence_transformers import SentenceTransformer
 import joblib
 from agents.agent import Agent
+from agents.embeddings import get_embedding_service
 
 
 
@@ -17,10 +17,11 @@ class RandomForestAgent(Agent):
     def __init__(self):
         """
         Initialize this object by loading in the saved model weights
-        and the SentenceTransformer vector encoding model
+        and the SentenceTransformer vector encoding model, shared with the Frontier Agent
         """
         self.log("Random Forest Agent is initializing")
-        self.vectorizer = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.vectorizer = get_embedding_service()
+        self.vectorizer.load()
         self.model = joblib.load('random_forest_model.pkl')
         self.log("Random Forest Agent is ready")
 
@@ -32,6 +33,20 @@ class RandomForestAgent(Agent):
         """        
         self.log("Random Forest Agent is starting a prediction")
         vector = self.vectorizer.encode([description])
-        result = max(0, self.model.predict(vector)[0])
+        with self.span("predict", items=1):
+            result = max(0, self.model.predict(vector)[0])
         self.log(f"Random Forest Agent completed - predicting ${result:.2f}")
-        return result
\ No newline at end of file
+        return result
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of many items with one encode and one predict
+        :param descriptions: the products to be estimated
+        :return: the prices as a list of floats, in the same order
+        """
+        self.log(f"Random Forest Agent is starting a batch of {len(descriptions)} predictions")
+        vectors = self.vectorizer.encode(descriptions)
+        with self.span("predict", items=len(descriptions)):
+            results = [max(0, result) for result in self.model.predict(vectors).tolist()]
+        self.log(f"Random Forest Agent completed a batch of {len(results)} predictions")
+        return results
@@ -1,10 +1,99 @@
 import os
 import json
-from typing import Optional, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Iterator
 from openai import OpenAI
-from agents.deals import ScrapedDeal, DealSelection
+from agents.deals import ScrapedDeal, DealSelection, Deal
+from agents.seen_urls import SeenUrls, KnownUrls
+from agents.opportunity_store import OpportunityStore
+from agents.fetcher import AsyncDealFetcher, run_sync
+from agents.http_cache import HttpCache
+from agents.deal_ranker import DealRanker
 from agents.agent import Agent
 
+# tiktoken counts tokens exactly when it's available; otherwise assume about 4 characters per token
+# The encoding is loaded on first use, since the first load downloads its BPE file
+ENCODING_NAME = "o200k_base"
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    The tiktoken encoding, or False if tiktoken isn't installed or the encoding can't be loaded, for example offline
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception:
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    return len(encoding.encode(text)) if encoding else (len(text) + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut this text down to at most max_tokens tokens
+    """
+    encoding = get_encoding()
+    if encoding:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+class DealStreamParser:
+    """
+    Pulls each complete deal out of a streamed {"deals": [{...}, {...}]} JSON response as soon as its closing brace arrives
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start = None
+
+    def feed(self, text: str) -> List[Deal]:
+        """
+        Add the next chunk of the response and return the deals that it completed
+        """
+        self.buffer += text
+        deals = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                # Depth 1 is the outer object and depth 2 the deals array, so an object opening at depth 3 is a deal
+                if char == "{" and self.depth == 3:
+                    self.start = self.position
+            elif char in "}]":
+                if char == "}" and self.depth == 3 and self.start is not None:
+                    deals.append(Deal.model_validate_json(self.buffer[self.start:self.position + 1]))
+                    self.start = None
+                self.depth -= 1
+            self.position += 1
+        return deals
+
 
 class ScannerAgent(Agent):
 
@@ -35,6 +124,21 @@ class ScannerAgent(Agent):
 
     USER_PROMPT_SUFFIX = "\n\nStrictly respond in JSON and include exactly 5 deals, no more."
 
+    FINAL_PROMPT_PREFIX = """These deals were each selected and summarized from a longer list. Respond with the 5 of them that have the most detailed, high quality product description and a clear price that is greater than 0.
+    Respond strictly in JSON, and only JSON. Keep each product_description, price and url exactly as provided.
+    
+    Deals:
+    
+    """
+
+    # The most tokens of each deal's description that are sent to the model
+    MAX_DEAL_TOKENS = 300
+    # Deals are split into shards of this size, which are scanned in parallel
+    SHARD_SIZE = 10
+    NUM_DEALS_SELECTION = 5
+    # Only this many of the best deals, scored locally by the DealRanker, are sent to the model
+    TOP_K = 20
+
     name = "Scanner Agent"
     color = Agent.CYAN
 
@@ -44,64 +148,215 @@ class ScannerAgent(Agent):
         """
         self.log("Scanner Agent is initializing")
         self.openai = OpenAI()
+        self.seen = SeenUrls()
+        self.fetcher = AsyncDealFetcher(cache=HttpCache())
+        self.ranker = DealRanker(top_k=self.TOP_K)
+        self.usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        self.usage_lock = threading.Lock()
         self.log("Scanner Agent is ready")
 
-    def fetch_deals(self, memory) -> List[ScrapedDeal]:
+    async def fetch_deals_async(self, memory) -> List[ScrapedDeal]:
         """
         Look up deals published on RSS feeds
-        Return any new deals that are not already in the memory provided
+        Return any new deals that are not already in the memory provided, or scanned in an earlier run
+        Known deals are skipped before their detail pages are downloaded
+        An OpportunityStore is checked with its URL index; a list of Opportunities is turned into a set first
         """
         self.log("Scanner Agent is about to fetch deals from RSS feed")
-        urls = [opp.deal.url for opp in memory]
-        scraped = ScrapedDeal.fetch()
-        result = [scrape for scrape in scraped if scrape.url not in urls]
+        surfaced = memory if isinstance(memory, OpportunityStore) else {opp.deal.url for opp in memory}
+        known = KnownUrls(self.seen, surfaced)
+        result = await self.fetcher.fetch(skip_urls=known)
+        if self.fetcher.not_modified:
+            self.log(f"Scanner Agent found {self.fetcher.not_modified} feeds and pages unchanged since the last run")
+        if self.fetcher.feed_failures:
+            self.log(f"Scanner Agent could not read {self.fetcher.feed_failures} of {len(self.fetcher.feed_urls)} feeds")
+        if self.fetcher.failures:
+            self.log(f"Scanner Agent could not download {self.fetcher.failures} deals")
         self.log(f"Scanner Agent received {len(result)} deals not already scraped")
         return result
 
+    def fetch_deals(self, memory) -> List[ScrapedDeal]:
+        """
+        Look up new deals published on RSS feeds, from synchronous code
+        """
+        with self.span("fetch_deals") as span:
+            result = run_sync(self.fetch_deals_async(memory))
+            span.add("deals", len(result))
+            span.add("cache_hits", self.fetcher.not_modified)
+            span.add("failures", self.fetcher.failures)
+            span.add("feed_failures", self.fetcher.feed_failures)
+        return result
+
+    def describe(self, scrape: ScrapedDeal) -> str:
+        """
+        Describe a scraped deal for the prompt, truncated to MAX_DEAL_TOKENS but always keeping its URL
+        """
+        url = f"\nURL: {scrape.url}"
+        text = f"Title: {scrape.title}\nDetails: {scrape.details.strip()}\nFeatures: {scrape.features.strip()}"
+        return truncate_tokens(text, self.MAX_DEAL_TOKENS) + url
+
     def make_user_prompt(self, scraped) -> str:
         """
         Create a user prompt for OpenAI based on the scraped deals provided
+        Each deal is held to MAX_DEAL_TOKENS plus its URL; the size of the prompt is logged against that budget
         """
         user_prompt = self.USER_PROMPT_PREFIX
-        user_prompt += '\n\n'.join([scrape.describe() for scrape in scraped])
+        user_prompt += '\n\n'.join([self.describe(scrape) for scrape in scraped])
         user_prompt += self.USER_PROMPT_SUFFIX
+        tokens = count_tokens(self.SYSTEM_PROMPT) + count_tokens(user_prompt)
+        self.log(f"Scanner Agent built a prompt of about {tokens} tokens for {len(scraped)} deals, "
+                 f"each held to {self.MAX_DEAL_TOKENS} tokens plus its URL")
         return user_prompt
 
+    def make_final_prompt(self, deals: List[Deal]) -> str:
+        """
+        Create a user prompt to choose among deals that have already been selected from the shards
+        """
+        user_prompt = self.FINAL_PROMPT_PREFIX
+        user_prompt += '\n\n'.join([deal.model_dump_json() for deal in deals])
+        user_prompt += self.USER_PROMPT_SUFFIX
+        return user_prompt
+
+    def messages_for(self, user_prompt: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def record_usage(self, usage, span=None):
+        with self.usage_lock:
+            self.usage["calls"] += 1
+            if usage:
+                self.usage["input_tokens"] += usage.input_tokens
+                self.usage["output_tokens"] += usage.output_tokens
+        if usage and span:
+            span.add("input_tokens", usage.input_tokens)
+            span.add("output_tokens", usage.output_tokens)
+
+    def call_model(self, user_prompt: str) -> DealSelection:
+        """
+        Call OpenAI using Structured Output, and add the tokens used to this scan's usage
+        """
+        ## Earlier I was using the beta version but switched to production
+        # result = self.openai.beta.chat.completions.parse(
+        #     model=self.MODEL,
+        #     messages=[
+        #         {"role": "system", "content": self.SYSTEM_PROMPT},
+        #         {"role": "user", "content": user_prompt}
+        #   ],
+        #     response_format=DealSelection
+        # )
+        # result = result.choices[0].message.parsed
+
+        # The beta version is now in production, so using productionized call
+        with self.span("call_model") as span:
+            result = self.openai.responses.parse(
+                model=self.MODEL,
+                input=self.messages_for(user_prompt),
+                text_format=DealSelection #this is how get structured output so a format description is not necessary in the system and user prompt but its always good to describe it in both places.
+            )
+            self.record_usage(result.usage, span)
+        return result.output_parsed
+
+    def stream_model(self, user_prompt: str) -> Iterator[Deal]:
+        """
+        Call OpenAI using Structured Output with streaming, and yield each deal as soon as it has been received
+        The span runs until the stream is complete, so it includes any time the caller spends between deals
+        """
+        parser = DealStreamParser()
+        with self.span("stream_model") as span, \
+                self.openai.responses.stream(model=self.MODEL, input=self.messages_for(user_prompt), text_format=DealSelection) as stream:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield from parser.feed(event.delta)
+            self.record_usage(stream.get_final_response().usage, span)
+
+    def scan_shards(self, scraped: List[ScrapedDeal]) -> List[Deal]:
+        """
+        Split the scraped deals into shards of SHARD_SIZE and ask the model to select from each in parallel
+        A shard whose call fails is left out, and its deals are not marked as seen
+        :return: the deals selected from all the shards
+        """
+        shards = [scraped[i:i + self.SHARD_SIZE] for i in range(0, len(scraped), self.SHARD_SIZE)]
+        self.log(f"Scanner Agent is calling OpenAI using Structured Output on {len(shards)} shards in parallel")
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(self.call_model, self.make_user_prompt(shard)) for shard in shards]
+        winners = []
+        for shard, future in zip(shards, futures):
+            try:
+                winners.extend(future.result().deals)
+                self.seen.add_many(scrape.url for scrape in shard)
+            except Exception as e:
+                self.log(f"Scanner Agent could not scan a shard of {len(shard)} deals: {e}")
+        return winners
+
+    def rank_deals(self, scraped: List[ScrapedDeal]) -> List[ScrapedDeal]:
+        """
+        Score the scraped deals locally and keep only the TOP_K with a clear price and the most detail
+        Deals with no clear price are marked as seen, so their pages aren't downloaded again;
+        deals that only missed the top K are not, so a later run can consider them
+        """
+        with self.span("rank_deals"):
+            kept, rejected, stats = self.ranker.rank(scraped)
+        self.seen.add_many(scrape.url for scrape in rejected)
+        self.log(f"Scanner Agent kept {stats['kept']} of {stats['scraped']} deals after local ranking: "
+                 f"{stats['no_clear_price']} had no clear price and {stats['over_top_k']} outside the top {self.TOP_K} were deferred")
+        return kept
+
+    def select(self, scraped: List[ScrapedDeal]) -> Iterator[Deal]:
+        """
+        Yield the selected deals with a price > 0, as early as possible
+        A single shard is streamed directly; otherwise the shards are scanned in parallel,
+        and if they select more than 5 deals between them, a final small call chooses among their summaries and is streamed
+        """
+        self.usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        if len(scraped) <= self.SHARD_SIZE:
+            self.log("Scanner Agent is calling OpenAI using Structured Output with streaming")
+            deals = self.stream_model(self.make_user_prompt(scraped))
+        else:
+            winners = [deal for deal in self.scan_shards(scraped) if deal.price > 0]
+            if len(winners) > self.NUM_DEALS_SELECTION:
+                self.log(f"Scanner Agent is choosing the final deals from {len(winners)} shard winners")
+                deals = self.stream_model(self.make_final_prompt(winners))
+            else:
+                deals = iter(winners)
+        count = 0
+        failed = False
+        # The caller may stop reading once it has enough deals, which closes this generator at a yield,
+        # so the bookkeeping runs in the finally block; only a failed model call leaves the deals unseen, as for a shard
+        try:
+            for deal in deals:
+                if deal.price > 0: #skip any deals if the price is <=0 because we don't want any deals with 0 price
+                    count += 1
+                    yield deal
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if len(scraped) <= self.SHARD_SIZE and not failed:
+                self.seen.add_many(scrape.url for scrape in scraped)
+            self.log(f"Scanner Agent used {self.usage['input_tokens']} prompt tokens and {self.usage['output_tokens']} output tokens in {self.usage['calls']} calls")
+            self.log(f"Scanner Agent received {count} selected deals with price>0 from OpenAI")
+
+    def scan_stream(self, memory: List[str]=[]) -> Iterator[Deal]:
+        """
+        Like scan, but yield each selected deal as soon as it has been parsed from the model's streamed response
+        :param memory: a list of URLs representing deals already raised
+        """
+        scraped = self.rank_deals(self.fetch_deals(memory))
+        if scraped:
+            yield from self.select(scraped)
+
     def scan(self, memory: List[str]=[]) -> Optional[DealSelection]:
         """
         Call OpenAI to provide a high potential list of deals with good descriptions and prices
         Use StructuredOutputs to ensure it conforms to our specifications
+        The deals are ranked locally first, then scanned in parallel shards, and if the shards select more than 5 deals between them,
+        a final small call chooses among their summaries
         :param memory: a list of URLs representing deals already raised
         :return: a selection of good deals, or None if there aren't any
         """
-        scraped = self.fetch_deals(memory)
+        scraped = self.rank_deals(self.fetch_deals(memory))
         if scraped:
-            user_prompt = self.make_user_prompt(scraped)
-            self.log("Scanner Agent is calling OpenAI using Structured Output")
-
-            ## Earlier I was using the beta version but switched to production
-            # result = self.openai.beta.chat.completions.parse(
-            #     model=self.MODEL,
-            #     messages=[
-            #         {"role": "system", "content": self.SYSTEM_PROMPT},
-            #         {"role": "user", "content": user_prompt}
-            #   ],
-            #     response_format=DealSelection
-            # )
-            # result = result.choices[0].message.parsed
-
-            # The beta version is now in production, so using productionized call
-            result = self.openai.responses.parse(
-                model="gpt-4o-mini",
-                input=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-                text_format=DealSelection #this is how get structured output so a format description is not necessary in the system and user prompt but its always good to describe it in both places.
-            )
-            result = result.output_parsed
-            result.deals = [deal for deal in result.deals if deal.price>0] #remove any deals if the price is <=0 because we don't want any deals with 0 price
-            self.log(f"Scanner Agent received {len(result.deals)} selected deals with price>0 from OpenAI")
-            return result
+            return DealSelection(deals=list(self.select(scraped)))
         return None
-                
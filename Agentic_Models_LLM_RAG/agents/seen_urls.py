@@ -0,0 +1,52 @@
+import os
+import threading
+from typing import Iterable, Container
+
+
+class SeenUrls:
+    """
+    A persisted index of the URLs of deals that have already been scanned
+    URLs are held in a set for O(1) lookups, and appended to a text file, one per line, as they are added
+    """
+
+    FILENAME = "seen_urls.txt"
+
+    def __init__(self, path: str = FILENAME):
+        """
+        :param path: the text file that stores the URLs
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.urls = set()
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.urls = {line.strip() for line in file if line.strip()}
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.urls
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def add_many(self, urls: Iterable[str]):
+        """
+        Record these URLs as seen, appending the new ones to the file
+        """
+        with self.lock:
+            new = [url for url in dict.fromkeys(urls) if url not in self.urls]
+            if new:
+                with open(self.path, "a") as file:
+                    file.writelines(url + "\n" for url in new)
+                self.urls.update(new)
+
+
+class KnownUrls:
+    """
+    The union of several containers of URLs, such as the SeenUrls and the OpportunityStore, checked in turn without copying them
+    """
+
+    def __init__(self, *containers: Container[str]):
+        self.containers = containers
+
+    def __contains__(self, url: str) -> bool:
+        return any(url in container for container in self.containers)
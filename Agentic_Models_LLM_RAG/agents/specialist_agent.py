@@ -1,4 +1,4 @@
-import modal
+from typing import List
 from agents.agent import Agent
 
 
@@ -15,6 +15,7 @@ class SpecialistAgent(Agent):
         Set up this Agent by creating an instance of the modal class
         """
         self.log("Specialist Agent is initializing - connecting to modal")
+        import modal
         Pricer = modal.Cls.from_name("pricer-service", "Pricer")
         self.pricer = Pricer()
         self.log("Specialist Agent is ready")
@@ -24,6 +25,17 @@ class SpecialistAgent(Agent):
         Make a remote call to return the estimate of the price of this item
         """
         self.log("Specialist Agent is calling remote fine-tuned model")
-        result = self.pricer.price.remote(description)
+        with self.span("modal_price"):
+            result = self.pricer.price.remote(description)
         self.log(f"Specialist Agent completed - predicting ${result:.2f}")
         return result
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Make a single remote call to estimate the prices of all these items in batches
+        """
+        self.log(f"Specialist Agent is calling remote fine-tuned model with a batch of {len(descriptions)} items")
+        with self.span("modal_price_batch", items=len(descriptions)):
+            results = self.pricer.price_batch.remote(descriptions)
+        self.log(f"Specialist Agent completed a batch of {len(results)} predictions")
+        return results
@@ -0,0 +1,52 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+
+class StartupProfile:
+    """
+    Records how long each import and each Agent takes to get ready, so that the time to the first scan can be measured
+    Agents that are initialized concurrently overlap, so their times add up to more than the elapsed time
+    """
+
+    def __init__(self):
+        self.timings: List[Tuple[str, str, float]] = []
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, name: str, seconds: float):
+        with self.lock:
+            self.timings.append((kind, name, seconds))
+
+    @contextmanager
+    def measure(self, kind: str, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    def timed(self, kind: str, name: str, function: Callable, *args, **kwargs):
+        """
+        Call the function and record how long it took
+        """
+        with self.measure(kind, name):
+            return function(*args, **kwargs)
+
+    def report(self) -> str:
+        """
+        A table of the timings, grouped by kind and slowest first within each kind
+        """
+        with self.lock:
+            timings = list(self.timings)
+        lines = []
+        for kind in dict.fromkeys(kind for kind, _, _ in timings):
+            lines.append(f"{kind}:")
+            rows = sorted(((name, seconds) for k, name, seconds in timings if k == kind), key=lambda row: -row[1])
+            for name, seconds in rows:
+                lines.append(f"  {name:<40} {seconds:8.2f}s")
+        return "\n".join(lines)
+
+
+# The profile of this process, filled in as the Agent Framework starts up
+profile = StartupProfile()
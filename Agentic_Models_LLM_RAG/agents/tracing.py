@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Tuple
+
+
+class Histogram:
+    """
+    A rolling window of the most recent durations of one operation, with its running count and total
+    Percentiles are computed over the window when they're exported, not when durations are recorded
+    """
+
+    PERCENTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window: int = 1024):
+        self.durations = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float):
+        self.durations.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentiles(self) -> Dict[float, float]:
+        ordered = sorted(self.durations)
+        if not ordered:
+            return {p: 0.0 for p in self.PERCENTILES}
+        return {p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] for p in self.PERCENTILES}
+
+
+class Span:
+    """
+    The timing of one operation, with counters such as tokens and cache hits that are added while it runs
+    """
+
+    def __init__(self, tracer: "Tracer", component: str, operation: str, counters: Dict[str, float]):
+        self.tracer = tracer
+        self.key = (component, operation)
+        self.counters = dict(counters)
+        self.start = 0.0
+
+    def add(self, counter: str, value: float = 1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # A generator closed by its caller exits with GeneratorExit, which isn't a failure
+        failed = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+        self.tracer.finish(self, time.perf_counter() - self.start, failed=failed)
+        return False
+
+
+class NullSpan:
+    """
+    What a disabled Tracer hands out: a single shared object that does nothing
+    """
+
+    def add(self, counter: str, value: float = 1):
+        pass
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """
+    Collects spans from the Agents and the Agent Framework into a rolling histogram per operation, and sums their counters
+    Exports a Prometheus text file and a JSON snapshot
+    When disabled, span() returns NULL_SPAN, so instrumented code costs one attribute check
+    """
+
+    PROMETHEUS_FILENAME = "metrics.prom"
+    JSON_FILENAME = "metrics.json"
+
+    def __init__(self, enabled: bool = False, window: int = 1024):
+        """
+        :param enabled: whether to record spans
+        :param window: how many of the most recent durations of each operation the percentiles are computed over
+        """
+        self.enabled = enabled
+        self.window = window
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.counters: Dict[Tuple[str, str, str], float] = {}
+        self.lock = threading.Lock()
+
+    def span(self, component: str, operation: str, **counters: float):
+        """
+        Time an operation with a with block; counters can be passed here or added to the span as it runs
+        :param component: the Agent or other part of the framework, such as "Scanner Agent"
+        :param operation: what it is doing, such as "fetch_deals"
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, component, operation, counters)
+
+    def finish(self, span: Span, seconds: float, failed: bool = False):
+        component, operation = span.key
+        with self.lock:
+            if span.key not in self.histograms:
+                self.histograms[span.key] = Histogram(self.window)
+            self.histograms[span.key].add(seconds)
+            if failed:
+                span.add("errors")
+            for counter, value in span.counters.items():
+                key = (component, operation, counter)
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> List[Dict]:
+        """
+        The count, total and percentiles of the durations, and the counters, of every operation
+        """
+        with self.lock:
+            result = []
+            for (component, operation), histogram in sorted(self.histograms.items()):
+                percentiles = histogram.percentiles()
+                result.append({
+                    "component": component,
+                    "operation": operation,
+                    "count": histogram.count,
+                    "total_seconds": round(histogram.total, 6),
+                    "p50": round(percentiles[0.5], 6),
+                    "p95": round(percentiles[0.95], 6),
+                    "p99": round(percentiles[0.99], 6),
+                    "counters": {counter: value for (c, o, counter), value in sorted(self.counters.items())
+                                 if (c, o) == (component, operation)},
+                })
+            return result
+
+    @staticmethod
+    def labels(component: str, operation: str, **extra: str) -> str:
+        labels = {"component": component, "operation": operation, **extra}
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+    def prometheus(self) -> str:
+        """
+        The snapshot in the Prometheus text exposition format, as a summary of span durations and a counter per span counter
+        """
+        lines = ["# HELP agent_span_seconds Duration of agent operations",
+                 "# TYPE agent_span_seconds summary"]
+        snapshot = self.snapshot()
+        for entry in snapshot:
+            component, operation = entry["component"], entry["operation"]
+            for quantile in ("p50", "p95", "p99"):
+                label = self.labels(component, operation, quantile=f"0.{quantile[1:]}")
+                lines.append(f"agent_span_seconds{label} {entry[quantile]}")
+            lines.append(f"agent_span_seconds_sum{self.labels(component, operation)} {entry['total_seconds']}")
+            lines.append(f"agent_span_seconds_count{self.labels(component, operation)} {entry['count']}")
+        lines += ["# HELP agent_span_counter_total Tokens, cache hits and other counts recorded on agent operations",
+                  "# TYPE agent_span_counter_total counter"]
+        for entry in snapshot:
+            for counter, value in entry["counters"].items():
+                label = self.labels(entry["component"], entry["operation"], counter=counter)
+                lines.append(f"agent_span_counter_total{label} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, prometheus_path: str = PROMETHEUS_FILENAME, json_path: str = JSON_FILENAME):
+        """
+        Write the Prometheus text file and the JSON snapshot, each replaced atomically
+        """
+        if not self.enabled:
+            return
+        for path, text in ((prometheus_path, self.prometheus()), (json_path, json.dumps(self.snapshot(), indent=2))):
+            temporary = path + ".tmp"
+            with open(temporary, "w") as file:
+                file.write(text)
+            os.replace(temporary, path)
+
+
+def enabled_by_env() -> bool:
+    return os.getenv("AGENT_TRACING", "").lower() in ("1", "true", "yes")
+
+
+# The tracer of this process; set AGENT_TRACING=1 to enable it
+tracer = Tracer(enabled=enabled_by_env())
@@ -0,0 +1,317 @@
+import os
+import json
+from typing import List, Tuple
+import numpy as np
+
+# The number of set bits in each possible byte, for Hamming distances between packed binary codes
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+# The nearest products to one query: their documents, prices and squared L2 distances, closest first
+Neighbours = Tuple[List[str], List[float], List[float]]
+
+
+class ChromaBackend:
+    """
+    Retrieval straight from a Chroma collection, as the Frontier Agent has always done it
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __len__(self) -> int:
+        return self.collection.count()
+
+    def query(self, vectors: np.ndarray, k: int = 5) -> List[Neighbours]:
+        """
+        Find the k nearest products to each of the vectors, with one Chroma query
+        :param vectors: a numpy array with one row per query
+        :return: the documents, prices and distances of the neighbours of each query, closest first
+        """
+        if len(vectors) == 0:
+            return []
+        results = self.collection.query(query_embeddings=np.asarray(vectors, dtype=float).tolist(), n_results=k)
+        return [
+            (documents, [m['price'] for m in metadatas], list(distances))
+            for documents, metadatas, distances in zip(results['documents'], results['metadatas'], results['distances'])
+        ]
+
+
+class IVFIndex:
+    """
+    An inverted-file index over the products, held in .npy files that are memory-mapped rather than read in
+    The vectors are clustered with k-means and stored sorted by cluster, so each cluster is a contiguous slice of the file;
+    a query is compared with the centroids, and then only with the vectors in its nprobe nearest clusters
+    Prices, category codes and the offsets of the documents in a single UTF-8 blob are parallel arrays in the same order,
+    so loading the index reads just a few small headers, and the operating system pages the rest in as queries touch it
+
+    The vectors can also be searched through a quantized copy: int8 with a scale per dimension (4x smaller),
+    or one bit per dimension, set when the value is above that dimension's mean (32x smaller)
+    The quantized copy scores every candidate, and just the best RERANK of them are re-ranked with the float vectors
+    """
+
+    QUANTIZATIONS = (None, "int8", "binary")
+    RERANK = 50
+
+    DIRECTORY = "products_index"
+    NLIST = 1024
+    NPROBE = 16
+    TRAINING_SAMPLE = 100_000
+    KMEANS_ITERATIONS = 10
+    CHUNK = 20_000
+
+    def __init__(self, directory: str = DIRECTORY, nprobe: int = NPROBE, quantization: str = None):
+        """
+        Open an index that has already been built
+        :param directory: the directory the index was built in
+        :param nprobe: how many clusters to search for each query; more is slower but finds more of the true neighbours
+        :param quantization: None to score candidates with the float vectors, or "int8" or "binary"
+        to score them with the quantized copy and re-rank the best with the float vectors
+        """
+        if quantization not in self.QUANTIZATIONS:
+            raise ValueError(f"quantization must be one of {self.QUANTIZATIONS}")
+        self.directory = directory
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.centroids = self.load_array("centroids")
+        self.offsets = self.load_array("offsets")
+        self.vectors = self.load_array("vectors")
+        self.norms = self.load_array("norms")
+        self.prices = self.load_array("prices")
+        self.category_codes = self.load_array("categories")
+        self.document_offsets = self.load_array("document_offsets")
+        self.documents = self.load_array("documents")
+        with open(os.path.join(directory, "index.json")) as file:
+            self.info = json.load(file)
+        self.category_names = self.info["categories"]
+        self.centroid_norms = (self.centroids ** 2).sum(axis=1)
+        if quantization == "int8":
+            self.int8_vectors = self.load_array("vectors_int8")
+            self.int8_scales = self.load_array("int8_scales")
+        elif quantization == "binary":
+            self.binary_vectors = self.load_array("vectors_binary")
+            self.binary_means = self.load_array("binary_means")
+
+    @classmethod
+    def exists(cls, directory: str = DIRECTORY) -> bool:
+        return os.path.exists(os.path.join(directory, "index.json"))
+
+    def load_array(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def document(self, row: int) -> str:
+        start, end = self.document_offsets[row], self.document_offsets[row + 1]
+        return bytes(self.documents[start:end]).decode("utf-8")
+
+    def category(self, row: int) -> str:
+        return self.category_names[self.category_codes[row]]
+
+    def search(self, vectors: np.ndarray, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest rows to each vector by squared L2 distance, as Chroma does
+        :param vectors: a numpy array with one row per query
+        :return: arrays of the rows and the distances of the neighbours of each query, closest first
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        probe = min(self.nprobe, len(self.centroids))
+        scores = self.centroid_norms[None, :] - 2 * vectors @ self.centroids.T
+        clusters = np.argpartition(scores, probe - 1, axis=1)[:, :probe]
+        rows = np.full((len(vectors), k), -1, dtype=np.int64)
+        distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        for i, (vector, probed) in enumerate(zip(vectors, clusters)):
+            candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probed])
+            if len(candidates) == 0:
+                continue
+            if self.quantization:
+                candidates = self.shortlist(vector, candidates, max(k, self.RERANK))
+            candidate_distances = self.distances(vector, candidates)
+            top = min(k, len(candidates))
+            best = np.argpartition(candidate_distances, top - 1)[:top]
+            best = best[np.argsort(candidate_distances[best])]
+            rows[i, :top] = candidates[best]
+            distances[i, :top] = candidate_distances[best]
+        return rows, distances
+
+    def distances(self, vector: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """
+        The squared L2 distances from the vector to these rows, which lie in a few contiguous runs of the file
+        """
+        return (float(vector @ vector) - 2 * (self.vectors[candidates] @ vector) + self.norms[candidates]).astype(np.float32)
+
+    def shortlist(self, vector: np.ndarray, candidates: np.ndarray, size: int) -> np.ndarray:
+        """
+        The candidates that score best on the quantized vectors, to be re-ranked with the float vectors
+        """
+        if len(candidates) <= size:
+            return candidates
+        if self.quantization == "int8":
+            # Approximate squared L2 distance, with the dot product taken against the dequantized vectors
+            scores = self.norms[candidates] - 2 * (self.int8_vectors[candidates].astype(np.float32) @ (vector * self.int8_scales))
+        else:
+            code = np.packbits(vector > self.binary_means)
+            scores = POPCOUNT[np.bitwise_xor(self.binary_vectors[candidates], code)].sum(axis=1)
+        best = np.argpartition(scores, size - 1)[:size]
+        return np.sort(candidates[best])
+
+    def query(self, vectors: np.ndarray, k: int = 5) -> List[Neighbours]:
+        """
+        Find the k nearest products to each of the vectors
+        :param vectors: a numpy array with one row per query
+        :return: the documents, prices and distances of the neighbours of each query, closest first
+        """
+        rows, distances = self.search(vectors, k)
+        return [
+            ([self.document(row) for row in found if row >= 0],
+             [float(self.prices[row]) for row in found if row >= 0],
+             [float(d) for row, d in zip(found, dists) if row >= 0])
+            for found, dists in zip(rows, distances)
+        ]
+
+    @classmethod
+    def nearest_centroids(cls, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        norms = (centroids ** 2).sum(axis=1)
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), cls.CHUNK):
+            chunk = np.asarray(vectors[start:start + cls.CHUNK], dtype=np.float32)
+            assignments[start:start + cls.CHUNK] = np.argmin(norms[None, :] - 2 * chunk @ centroids.T, axis=1)
+        return assignments
+
+    @classmethod
+    def kmeans(cls, sample: np.ndarray, nlist: int, iterations: int = KMEANS_ITERATIONS, seed: int = 42) -> np.ndarray:
+        """
+        Cluster a sample of the vectors into nlist centroids with Lloyd's algorithm
+        A cluster that ends up empty keeps its previous centroid
+        """
+        rng = np.random.default_rng(seed)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = cls.nearest_centroids(sample, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return centroids
+
+    @classmethod
+    def build(cls, collection, directory: str = DIRECTORY, nlist: int = NLIST, page_size: int = 10_000) -> "IVFIndex":
+        """
+        Build an index of every product in a Chroma collection, reading it a page at a time
+        :param collection: the Chroma collection of products
+        :param directory: where to write the index files
+        :param nlist: how many clusters to divide the vectors into
+        :return: the index, opened from the files just written
+        """
+        os.makedirs(directory, exist_ok=True)
+        count = collection.count()
+        first = collection.get(include=['embeddings'], limit=1)
+        dimensions = len(first['embeddings'][0])
+        raw_path = os.path.join(directory, "unsorted_vectors.npy")
+        raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float32, shape=(count, dimensions))
+        prices = np.empty(count, dtype=np.float32)
+        categories, documents = [], []
+        for offset in range(0, count, page_size):
+            page = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+            size = len(page['documents'])
+            raw[offset:offset + size] = np.asarray(page['embeddings'], dtype=np.float32)
+            prices[offset:offset + size] = [metadata['price'] for metadata in page['metadatas']]
+            categories.extend(metadata['category'] for metadata in page['metadatas'])
+            documents.extend(page['documents'])
+
+        nlist = min(nlist, count)
+        rng = np.random.default_rng(42)
+        sample = np.asarray(raw[np.sort(rng.choice(count, min(count, cls.TRAINING_SAMPLE), replace=False))])
+        centroids = cls.kmeans(sample, nlist)
+        assignments = cls.nearest_centroids(raw, centroids)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64)
+
+        vectors = np.lib.format.open_memmap(os.path.join(directory, "vectors.npy"), mode="w+", dtype=np.float32, shape=(count, dimensions))
+        norms = np.empty(count, dtype=np.float32)
+        for start in range(0, count, cls.CHUNK):
+            # Read the rows in file order, then put them in cluster order
+            rows = order[start:start + cls.CHUNK]
+            sorted_rows = np.sort(rows)
+            chunk = np.asarray(raw[sorted_rows])[np.searchsorted(sorted_rows, rows)]
+            vectors[start:start + cls.CHUNK] = chunk
+            norms[start:start + cls.CHUNK] = (chunk ** 2).sum(axis=1)
+        vectors.flush()
+        del vectors, raw
+        os.remove(raw_path)
+
+        names = sorted(set(categories))
+        codes = {name: code for code, name in enumerate(names)}
+        encoded = [documents[row].encode("utf-8") for row in order]
+        document_offsets = np.concatenate([[0], np.cumsum([len(text) for text in encoded])]).astype(np.int64)
+        np.save(os.path.join(directory, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(directory, "offsets.npy"), offsets)
+        np.save(os.path.join(directory, "norms.npy"), norms)
+        np.save(os.path.join(directory, "prices.npy"), prices[order])
+        np.save(os.path.join(directory, "categories.npy"), np.array([codes[categories[row]] for row in order], dtype=np.uint8))
+        np.save(os.path.join(directory, "document_offsets.npy"), document_offsets)
+        np.save(os.path.join(directory, "documents.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        cls.quantize(directory)
+        with open(os.path.join(directory, "index.json"), "w") as file:
+            json.dump({"count": count, "dimensions": dimensions, "nlist": nlist, "categories": names}, file, indent=2)
+        return cls(directory)
+
+    @classmethod
+    def quantize(cls, directory: str = DIRECTORY):
+        """
+        Write the int8 and binary copies of the float vectors of an index, a chunk at a time
+        int8 values are the vector divided by a per-dimension scale that maps the largest absolute value to 127;
+        binary codes have a bit per dimension, packed 8 to a byte, set where the value is above the dimension's mean
+        """
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        count, dimensions = vectors.shape
+        peaks = np.zeros(dimensions, dtype=np.float32)
+        sums = np.zeros(dimensions, dtype=np.float64)
+        for start in range(0, count, cls.CHUNK):
+            chunk = np.asarray(vectors[start:start + cls.CHUNK])
+            peaks = np.maximum(peaks, np.abs(chunk).max(axis=0))
+            sums += chunk.sum(axis=0)
+        scales = np.where(peaks > 0, peaks / 127, 1).astype(np.float32)
+        means = (sums / max(count, 1)).astype(np.float32)
+        int8_vectors = np.lib.format.open_memmap(os.path.join(directory, "vectors_int8.npy"), mode="w+", dtype=np.int8, shape=(count, dimensions))
+        binary_vectors = np.lib.format.open_memmap(os.path.join(directory, "vectors_binary.npy"), mode="w+", dtype=np.uint8, shape=(count, (dimensions + 7) // 8))
+        for start in range(0, count, cls.CHUNK):
+            chunk = np.asarray(vectors[start:start + cls.CHUNK])
+            int8_vectors[start:start + cls.CHUNK] = np.clip(np.rint(chunk / scales), -127, 127)
+            binary_vectors[start:start + cls.CHUNK] = np.packbits(chunk > means, axis=1)
+        int8_vectors.flush()
+        binary_vectors.flush()
+        np.save(os.path.join(directory, "int8_scales.npy"), scales)
+        np.save(os.path.join(directory, "binary_means.npy"), means)
+
+
+def within_distance(neighbours: Neighbours, distance: float) -> Neighbours:
+    """
+    Just the neighbours no farther than the given distance, such as the live deals that are closer than the farthest product
+    The distances are comparable because every backend holds vectors from the same model, compared by squared L2
+    """
+    documents, prices, distances = neighbours
+    keep = [i for i, d in enumerate(distances) if d <= distance]
+    return [documents[i] for i in keep], [prices[i] for i in keep], [distances[i] for i in keep]
+
+
+def quantization_by_env() -> str:
+    """
+    The quantized search to use, from the VECTOR_QUANTIZATION environment variable: "int8", "binary", or unset for float
+    """
+    quantization = os.getenv("VECTOR_QUANTIZATION", "").lower() or None
+    if quantization not in IVFIndex.QUANTIZATIONS:
+        raise ValueError(f"VECTOR_QUANTIZATION must be one of {IVFIndex.QUANTIZATIONS[1:]}, not {quantization}")
+    return quantization
+
+
+def get_retrieval_backend(collection, directory: str = IVFIndex.DIRECTORY, quantization: str = None):
+    """
+    The memory-mapped IVFIndex if one has been built, otherwise the Chroma collection itself
+    :param quantization: for the IVFIndex, "int8" or "binary" to search the quantized copy first;
+    None takes it from the VECTOR_QUANTIZATION environment variable, and searches the float vectors if that's unset
+    """
+    if IVFIndex.exists(directory):
+        return IVFIndex(directory, quantization=quantization or quantization_by_env())
+    return ChromaBackend(collection)
@@ -0,0 +1,127 @@
+"""
+Micro-benchmark of the deal page extraction in agents/extraction.py against the original full-tree BeautifulSoup parse
+
+Pages are read from a directory of saved fixture pages (*.html for detail pages, *.xml for RSS feeds),
+or, by default, from the HttpCache that the Scanner Agent fills on each run:
+
+    python bench_extraction.py
+    python bench_extraction.py --pages fixtures/pages
+    python bench_extraction.py --save fixtures/pages     # copy the cached pages into a fixture directory
+"""
+
+import os
+import re
+import glob
+import time
+import sqlite3
+import argparse
+import tracemalloc
+from typing import List, Tuple, Callable
+import feedparser
+from bs4 import BeautifulSoup
+
+from agents.extraction import extract_summary, extract_details, PARSER
+from agents.http_cache import HttpCache
+
+
+def legacy_extract_summary(html_snippet: str) -> str:
+    """
+    The original summary extraction: two BeautifulSoup parses and a regex
+    """
+    soup = BeautifulSoup(html_snippet, 'html.parser')
+    snippet_div = soup.find('div', class_='snippet summary')
+    if snippet_div:
+        description = snippet_div.get_text(strip=True)
+        description = BeautifulSoup(description, 'html.parser').get_text()
+        description = re.sub('<[^<]+?>', '', description)
+        result = description.strip()
+    else:
+        result = html_snippet
+    return result.replace('\n', ' ')
+
+
+def legacy_extract_details(stuff: bytes) -> Tuple[str, str]:
+    """
+    The original detail page extraction: a full html.parser tree of the page
+    """
+    soup = BeautifulSoup(stuff, 'html.parser')
+    content = soup.find('div', class_='content-section').get_text()
+    content = content.replace('\nmore', '').replace('\n', ' ')
+    if "Features" in content:
+        details, features = content.split("Features", 1)
+    else:
+        details, features = content, ""
+    return details, features
+
+
+def load_pages(directory: str) -> Tuple[List[bytes], List[str]]:
+    """
+    Read detail pages and RSS summaries from a fixture directory, or from the HttpCache if directory is None
+    """
+    if directory:
+        pages = [open(path, 'rb').read() for path in sorted(glob.glob(os.path.join(directory, '*.html')))]
+        feed_bodies = [open(path, 'rb').read() for path in sorted(glob.glob(os.path.join(directory, '*.xml')))]
+    else:
+        connection = sqlite3.connect(HttpCache.DB_FILENAME)
+        rows = connection.execute("SELECT url, content FROM responses").fetchall()
+        pages = [bytes(content) for url, content in rows if 'rss=' not in url]
+        feed_bodies = [bytes(content) for url, content in rows if 'rss=' in url]
+    summaries = [entry['summary'] for body in feed_bodies for entry in feedparser.parse(body).entries]
+    return pages, summaries
+
+
+def save_pages(directory: str):
+    """
+    Copy the pages in the HttpCache into a fixture directory, so that the benchmark can be repeated on the same pages
+    """
+    os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(HttpCache.DB_FILENAME)
+    for i, (url, content) in enumerate(connection.execute("SELECT url, content FROM responses")):
+        extension = 'xml' if 'rss=' in url else 'html'
+        with open(os.path.join(directory, f"page_{i:04d}.{extension}"), 'wb') as file:
+            file.write(content)
+
+
+def measure(function: Callable, inputs: List, repeats: int) -> Tuple[float, float]:
+    """
+    :return: the mean milliseconds per input, and the peak traced memory in KB of a single call
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for item in inputs:
+            function(item)
+    elapsed = (time.perf_counter() - start) / (repeats * len(inputs)) * 1000
+    peak = 0
+    for item in inputs:
+        tracemalloc.start()
+        function(item)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed, peak / 1024
+
+
+def report(name: str, legacy: Callable, fast: Callable, inputs: List, repeats: int):
+    if not inputs:
+        print(f"{name}: no inputs found")
+        return
+    legacy_ms, legacy_kb = measure(legacy, inputs, repeats)
+    fast_ms, fast_kb = measure(fast, inputs, repeats)
+    print(f"{name} ({len(inputs)} inputs x {repeats})")
+    print(f"  original : {legacy_ms:8.3f} ms/item  peak {legacy_kb:9.1f} KB")
+    print(f"  targeted : {fast_ms:8.3f} ms/item  peak {fast_kb:9.1f} KB  ({legacy_ms / fast_ms:.1f}x faster, {legacy_kb / max(fast_kb, 1e-9):.1f}x less memory)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the deal page extraction")
+    parser.add_argument("--pages", help="a directory of saved *.html detail pages and *.xml feeds; defaults to the HttpCache")
+    parser.add_argument("--save", help="copy the pages in the HttpCache into this directory and exit")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save)
+    else:
+        pages, summaries = load_pages(args.pages)
+        print(f"Targeted extraction is using the {PARSER} parser")
+        report("Detail pages", legacy_extract_details, extract_details, pages, args.repeats)
+        report("RSS summaries", legacy_extract_summary, extract_summary, summaries, args.repeats)
@@ -0,0 +1,71 @@
+"""
+Report recall@5, memory and latency of the quantized searches of the IVF index against exact search
+
+The queries are the vectors of a random sample of the indexed products, each with a little noise added,
+and the exact answer for each is a brute-force scan of all the float vectors
+
+    python bench_quantization.py
+    python bench_quantization.py --queries 500 --nprobe 16 --nprobe 64
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+
+from agents.vector_index import IVFIndex
+
+K = 5
+
+
+def exact_search(vectors: np.ndarray, norms: np.ndarray, queries: np.ndarray, k: int = K) -> np.ndarray:
+    """
+    The rows of the k nearest vectors to each query, by a scan of every vector a chunk at a time
+    """
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), IVFIndex.CHUNK):
+        chunk = np.asarray(vectors[start:start + IVFIndex.CHUNK])
+        distances = norms[start:start + IVFIndex.CHUNK][None, :] - 2 * queries @ chunk.T
+        rows = np.broadcast_to(np.arange(start, start + len(chunk)), distances.shape)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_distances = np.concatenate([best_distances, distances], axis=1)
+        keep = np.argpartition(best_distances, k - 1, axis=1)[:, :k]
+        best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        best_distances = np.take_along_axis(best_distances, keep, axis=1)
+    return best_rows
+
+
+def file_megabytes(directory: str, name: str) -> float:
+    return os.path.getsize(os.path.join(directory, f"{name}.npy")) / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the quantized searches of the IVF index")
+    parser.add_argument("--index", default=IVFIndex.DIRECTORY)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, action="append", help="may be repeated; defaults to the index's NPROBE")
+    args = parser.parse_args()
+
+    index = IVFIndex(args.index)
+    rng = np.random.default_rng(42)
+    sample = np.sort(rng.choice(len(index), min(args.queries, len(index)), replace=False))
+    queries = np.asarray(index.vectors[sample]) + rng.normal(0, 0.01, (len(sample), index.vectors.shape[1])).astype(np.float32)
+
+    start = time.perf_counter()
+    truth = exact_search(index.vectors, np.asarray(index.norms), queries)
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"{len(index):,} vectors; {len(queries)} queries; exact search {exact_ms:.2f} ms/query")
+
+    memory = {None: file_megabytes(args.index, "vectors"),
+              "int8": file_megabytes(args.index, "vectors_int8"),
+              "binary": file_megabytes(args.index, "vectors_binary")}
+    print(f"{'search':<10} {'nprobe':>6} {'recall@5':>9} {'ms/query':>9} {'vectors MB':>11} {'reduction':>10}")
+    for nprobe in args.nprobe or [IVFIndex.NPROBE]:
+        for quantization in IVFIndex.QUANTIZATIONS:
+            searcher = IVFIndex(args.index, nprobe=nprobe, quantization=quantization)
+            start = time.perf_counter()
+            rows, _ = searcher.search(queries, K)
+            ms = (time.perf_counter() - start) / len(queries) * 1000
+            recall = np.mean([len(set(found) & set(expected)) / K for found, expected in zip(rows.tolist(), truth.tolist())])
+            print(f"{quantization or 'float32':<10} {nprobe:>6} {recall:>9.3f} {ms:>9.2f} {memory[quantization]:>11.1f} {memory[None] / memory[quantization]:>9.0f}x")
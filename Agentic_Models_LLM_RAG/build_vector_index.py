@@ -0,0 +1,69 @@
+"""
+Build the memory-mapped IVF index that the Frontier Agent searches instead of Chroma, once it exists
+
+    python build_vector_index.py
+    python build_vector_index.py --nlist 1024 --out products_index
+
+Add the int8 and binary copies of the vectors to an index built before they were written:
+
+    python build_vector_index.py --quantize
+
+The Frontier Agent searches the float vectors by default. To have it score candidates with a quantized copy first,
+and re-rank only the best of them with the float vectors, set VECTOR_QUANTIZATION before starting the framework:
+
+    VECTOR_QUANTIZATION=int8 python deal_agent_framework.py      # or binary
+
+or pass quantization="int8" to FrontierAgent. bench_quantization.py compares their recall, speed and size
+
+Then check how many of Chroma's nearest products the index finds, and how fast, on a sample of the products:
+
+    python build_vector_index.py --check 200
+    python build_vector_index.py --check 200 --quantization int8
+"""
+
+import time
+import argparse
+import numpy as np
+import chromadb
+
+from agents.vector_index import IVFIndex, ChromaBackend
+
+DB = "products_vectorstore"
+
+
+def check(index: IVFIndex, chroma: ChromaBackend, collection, samples: int, k: int = 5):
+    """
+    Compare the index with exact search in Chroma on the vectors of a sample of the products
+    """
+    vectors = np.asarray(collection.get(include=['embeddings'], limit=samples)['embeddings'], dtype=np.float32)
+    start = time.perf_counter()
+    expected = chroma.query(vectors, k)
+    chroma_ms = (time.perf_counter() - start) / len(vectors) * 1000
+    start = time.perf_counter()
+    found = index.query(vectors, k)
+    index_ms = (time.perf_counter() - start) / len(vectors) * 1000
+    recall = np.mean([len(set(a[0]) & set(b[0])) / k for a, b in zip(expected, found)])
+    print(f"recall@{k} {recall:.3f}; Chroma {chroma_ms:.2f} ms/query; IVF index {index_ms:.2f} ms/query (nprobe {index.nprobe})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped IVF index of the products")
+    parser.add_argument("--db", default=DB)
+    parser.add_argument("--out", default=IVFIndex.DIRECTORY)
+    parser.add_argument("--nlist", type=int, default=IVFIndex.NLIST)
+    parser.add_argument("--check", type=int, default=0, help="compare an existing index with Chroma on this many products")
+    parser.add_argument("--quantize", action="store_true", help="write the quantized copies of an existing index's vectors")
+    parser.add_argument("--quantization", choices=["int8", "binary"], help="with --check, search through this quantized copy")
+    args = parser.parse_args()
+
+    if args.quantize:
+        IVFIndex.quantize(args.out)
+        raise SystemExit
+    client = chromadb.PersistentClient(path=args.db)
+    collection = client.get_or_create_collection('products')
+    if args.check:
+        check(IVFIndex(args.out, quantization=args.quantization), ChromaBackend(collection), collection, args.check)
+    else:
+        start = time.perf_counter()
+        index = IVFIndex.build(collection, args.out, nlist=args.nlist)
+        print(f"Indexed {len(index):,} products in {index.info['nlist']} clusters in {time.perf_counter() - start:.0f}s")
@@ -1,15 +1,14 @@
-import os
 import sys
+import time
+import random
 import logging
-import json
-from typing import List, Optional
-from twilio.rest import Client
+import argparse
+import threading
+from typing import List, Optional, Callable
 from dotenv import load_dotenv
-import chromadb
-from agents.planning_agent import PlanningAgent
-from agents.deals import Opportunity
-from sklearn.manifold import TSNE
-import numpy as np
+from agents.opportunity_store import OpportunityStore
+from agents.startup import profile
+from agents.tracing import tracer, enabled_by_env
 
 
 # Colors for logging
@@ -38,62 +37,189 @@ class DealAgentFramework:
 
     DB = "products_vectorstore"
     MEMORY_FILENAME = "memory.json"
+    MEMORY_DB = "opportunities.db"
 
     def __init__(self):
         init_logging()
         load_dotenv()
-        client = chromadb.PersistentClient(path=self.DB)
+        tracer.enabled = tracer.enabled or enabled_by_env()
+        with profile.measure("import", "chromadb"):
+            import chromadb
+        self.client = chromadb.PersistentClient(path=self.DB)
         self.memory = self.read_memory()
-        self.collection = client.get_or_create_collection('products')
+        self.collection = self.client.get_or_create_collection('products')
         self.planner = None
+        # Runs share the memory, so only one may be in progress at a time
+        self.run_lock = threading.Lock()
 
     def init_agents_as_needed(self):
         if not self.planner:
             self.log("Initializing Agent Framework")
-            self.planner = PlanningAgent(self.collection)
-            self.log("Agent Framework is ready")
+            start = time.perf_counter()
+            # The agents pull in the heavy libraries, so they are only imported once the agents are needed
+            with profile.measure("import", "agents.planning_agent"):
+                from agents.planning_agent import PlanningAgent
+                from agents.live_store import LiveDealStore
+            # Every deal priced is written back to a "live" collection, where it becomes context for pricing later deals
+            live_store = LiveDealStore(self.client)
+            self.planner = profile.timed("agent", "Planning Agent", PlanningAgent, self.collection, live_store=live_store)
+            self.log(f"Agent Framework is ready after {time.perf_counter() - start:.1f}s")
         
-    def read_memory(self) -> List[Opportunity]:
-        if os.path.exists(self.MEMORY_FILENAME):
-            with open(self.MEMORY_FILENAME, "r") as file:
-                data = json.load(file)
-            opportunities = [Opportunity(**item) for item in data]
-            return opportunities
-        return []
-
-    def write_memory(self) -> None:
-        data = [opportunity.dict() for opportunity in self.memory]
-        with open(self.MEMORY_FILENAME, "w") as file:
-            json.dump(data, file, indent=2)
+    def read_memory(self) -> OpportunityStore:
+        """
+        Open the store of opportunities surfaced so far, importing memory.json the first time
+        """
+        return OpportunityStore(self.MEMORY_DB, legacy_path=self.MEMORY_FILENAME)
 
     def log(self, message: str):
         text = BG_BLUE + WHITE + "[Agent Framework] " + message + RESET
         logging.info(text)
 
-    def run(self) -> List[Opportunity]:
-        self.init_agents_as_needed()
-        logging.info("Kicking off Planning Agent")
-        result = self.planner.plan(memory=self.memory)
-        logging.info(f"Planning Agent has completed and returned: {result}")
-        if result:
-            self.memory.append(result)
-            self.write_memory()
-        return self.memory
+    def run(self) -> OpportunityStore:
+        with self.run_lock:
+            with tracer.span("Agent Framework", "run") as span:
+                self.init_agents_as_needed()
+                logging.info("Kicking off Planning Agent")
+                result = self.planner.plan(memory=self.memory)
+                logging.info(f"Planning Agent has completed and returned: {result}")
+                if result:
+                    self.memory.append(result)
+                    span.add("opportunities")
+            self.log_embedding_cache()
+            # Metrics are written after every run, to metrics.prom and metrics.json, when tracing is enabled
+            tracer.export()
+            return self.memory
+
+    def log_embedding_cache(self):
+        """
+        Log the running hit and miss counts of the shared embedding cache, and how many vectors it holds
+        """
+        from agents.embeddings import get_embedding_service
+        stats = get_embedding_service().stats()
+        lookups = stats["hits"] + stats["misses"]
+        if lookups:
+            self.log(f"Embedding cache has served {stats['hits']} of {lookups} lookups ({stats['hits'] / lookups:.0%}) "
+                     f"and holds {stats['size']} vectors")
 
     @classmethod
     def get_plot_data(cls, max_datapoints=10000):
-        client = chromadb.PersistentClient(path=cls.DB)
-        collection = client.get_or_create_collection('products')
-        result = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=max_datapoints)
-        vectors = np.array(result['embeddings'])
-        documents = result['documents']
-        categories = [metadata['category'] for metadata in result['metadatas']]
+        """
+        The 3D TSNE projection of the products in the datastore, read from the file saved next to it when it's up to date
+        """
+        from projection import VectorProjection
+        documents, reduced_vectors, categories = VectorProjection(cls.DB, max_datapoints=max_datapoints).get()
         colors = [COLORS[CATEGORIES.index(c)] for c in categories]
-        tsne = TSNE(n_components=3, random_state=42, n_jobs=-1)
-        reduced_vectors = tsne.fit_transform(vectors)
         return documents, reduced_vectors, colors
 
+class DealScheduler:
+    """
+    Runs the Agent Framework on a schedule in a background thread, one run at a time
+    Each wait is the interval with some random jitter; if a run takes longer than the interval,
+    the interval is doubled (up to MAX_BACKOFF times) until runs fit again
+    Subscribers are called with the memory after every run, so that a UI can show results without starting runs itself
+    """
+
+    INTERVAL = 300
+    JITTER = 0.1
+    MAX_BACKOFF = 4
+
+    def __init__(self, framework: DealAgentFramework, interval: float = INTERVAL, jitter: float = JITTER):
+        """
+        :param framework: the Agent Framework to run
+        :param interval: the seconds between the start of one run and the next
+        :param jitter: the fraction of the interval by which each wait is randomly lengthened or shortened
+        """
+        self.framework = framework
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff = 1
+        self.subscribers: List[Callable[[OpportunityStore], None]] = []
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def subscribe(self, callback: Callable[[OpportunityStore], None]):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[OpportunityStore], None]):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def run_once(self) -> bool:
+        """
+        Run the Agent Framework now, unless a run is already in progress, and publish the memory to subscribers
+        :return: True if a run took place, False if one was already in progress
+        """
+        if not self.running.acquire(blocking=False):
+            self.framework.log("Scheduler is skipping a run because the previous one is still in progress")
+            return False
+        try:
+            memory = self.framework.run()
+        except Exception as e:
+            self.framework.log(f"Scheduler run failed: {e}")
+            return True
+        finally:
+            self.running.release()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(memory)
+            except Exception as e:
+                self.framework.log(f"Scheduler subscriber failed: {e}")
+        return True
+
+    def next_wait(self, duration: float) -> float:
+        """
+        The seconds to wait after a run that took this long, backing off if it overran the interval
+        """
+        if duration > self.interval * self.backoff:
+            self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+            self.framework.log(f"Scheduler run took {duration:.0f}s; backing off to every {self.interval * self.backoff:.0f}s")
+        elif self.backoff > 1 and duration <= self.interval:
+            self.backoff = 1
+        period = self.interval * self.backoff * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(period - duration, 0)
+
+    def loop(self):
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            self.run_once()
+            self.stopped.wait(self.next_wait(time.monotonic() - start))
+
+    def start(self) -> "DealScheduler":
+        """
+        Start running in a background thread, with the first run straight away; does nothing if already started
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.loop, name="deal-scheduler", daemon=True)
+                self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def join(self):
+        while self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout=1)
+
 
 if __name__=="__main__":
-    DealAgentFramework().run()
+    parser = argparse.ArgumentParser(description="Run the Agent Framework once, or on a schedule")
+    parser.add_argument("--daemon", action="store_true", help="keep running on a schedule until interrupted")
+    parser.add_argument("--interval", type=float, default=DealScheduler.INTERVAL, help="seconds between runs")
+    args = parser.parse_args()
+    if args.daemon:
+        scheduler = DealScheduler(DealAgentFramework(), interval=args.interval).start()
+        try:
+            scheduler.join()
+        except KeyboardInterrupt:
+            scheduler.stop()
+    else:
+        DealAgentFramework().run()
     
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+Populate products_vectorstore from train.pkl, as in the Part-2a notebook, but as a restartable pipeline
+
+An encoder thread embeds batches of descriptions and puts them on a bounded queue, while the main thread writes
+the previous batches to Chroma, so encoding and writing overlap
+After each batch is written, the number of documents committed so far is saved to a checkpoint file,
+so a crashed or interrupted run carries on from there; documents whose doc_{i} id is already in the store are skipped
+
+    python ingest_products.py
+    python ingest_products.py --limit 20000 --batch 1000
+    python ingest_products.py --restart        # ignore the checkpoint and start from doc_0
+"""
+
+import os
+import json
+import time
+import queue
+import pickle
+import argparse
+import threading
+from typing import List
+
+import chromadb
+from sentence_transformers import SentenceTransformer
+from items import Item  # noqa: F401 - needed to unpickle train.pkl
+
+DB = "products_vectorstore"
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CHECKPOINT_FILENAME = "ingest_checkpoint.json"
+QUESTION = "How much does this cost to the nearest dollar?\n\n"
+
+
+def description(item) -> str:
+    text = item.prompt.replace(QUESTION, "")
+    return text.split("\n\nPrice is $")[0]
+
+
+def read_checkpoint(path: str) -> int:
+    """
+    The number of documents committed by earlier runs
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r") as file:
+        return json.load(file)["committed"]
+
+
+def write_checkpoint(path: str, committed: int):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        json.dump({"committed": committed, "updated": time.time()}, file)
+    os.replace(temporary, path)
+
+
+class Ingestion:
+    """
+    Encode and write the documents from start to end, one batch at a time, with encoding running ahead of writing
+    """
+
+    def __init__(self, collection, model, items: List, batch_size: int = 1000, queue_size: int = 4,
+                 checkpoint: str = CHECKPOINT_FILENAME):
+        self.collection = collection
+        self.model = model
+        self.items = items
+        self.batch_size = batch_size
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.checkpoint = checkpoint
+        self.error = None
+        self.skipped = 0
+
+    def encode(self, start: int, end: int):
+        """
+        The producer: embed each batch of documents not already in the store, and queue it for writing
+        A None on the queue means there are no more batches
+        """
+        try:
+            for i in range(start, end, self.batch_size):
+                batch = self.items[i:min(i + self.batch_size, end)]
+                ids = [f"doc_{j}" for j in range(i, i + len(batch))]
+                existing = set(self.collection.get(ids=ids, include=[])['ids'])
+                self.skipped += len(existing)
+                todo = [(id, item) for id, item in zip(ids, batch) if id not in existing]
+                documents = [description(item) for _, item in todo]
+                vectors = self.model.encode(documents) if documents else None
+                metadatas = [{"category": item.category, "price": item.price} for _, item in todo]
+                self.batches.put((i + len(batch), [id for id, _ in todo], documents, vectors, metadatas))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.batches.put(None)
+
+    def run(self, start: int, end: int):
+        """
+        The consumer: write each batch to Chroma as it arrives, then checkpoint it
+        """
+        encoder = threading.Thread(target=self.encode, args=(start, end), name="encoder", daemon=True)
+        encoder.start()
+        began = time.perf_counter()
+        written = 0
+        while (batch := self.batches.get()) is not None:
+            committed, ids, documents, vectors, metadatas = batch
+            if ids:
+                self.collection.add(ids=ids, documents=documents, embeddings=vectors, metadatas=metadatas)
+                written += len(ids)
+            write_checkpoint(self.checkpoint, committed)
+            rate = written / max(time.perf_counter() - began, 1e-9)
+            print(f"{committed:,}/{end:,} committed; {written:,} written this run, {self.skipped:,} already present; {rate:,.0f} docs/sec", flush=True)
+        encoder.join()
+        if self.error:
+            raise self.error
+        elapsed = time.perf_counter() - began
+        print(f"Wrote {written:,} documents in {elapsed:.0f}s: {written / max(elapsed, 1e-9):,.0f} docs/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Populate the Chroma datastore of products, resumably")
+    parser.add_argument("--train", default="train.pkl")
+    parser.add_argument("--db", default=DB)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--queue", type=int, default=4, help="how many encoded batches may wait to be written")
+    parser.add_argument("--limit", type=int, help="ingest only this many documents")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILENAME)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint; existing documents are still skipped")
+    args = parser.parse_args()
+
+    with open(args.train, "rb") as file:
+        train = pickle.load(file)
+    end = min(args.limit or len(train), len(train))
+    start = 0 if args.restart else min(read_checkpoint(args.checkpoint), end)
+    print(f"Ingesting documents {start:,} to {end:,}")
+
+    client = chromadb.PersistentClient(path=args.db)
+    collection = client.get_or_create_collection('products')
+    model = SentenceTransformer(MODEL_NAME)
+    Ingestion(collection, model, train, args.batch, args.queue, args.checkpoint).run(start, end)
@@ -1,5 +1,4 @@
 from typing import Optional
-from transformers import AutoTokenizer
 import re
 
 BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
@@ -13,7 +12,8 @@ class Item:
     An Item is a cleaned, curated datapoint of a Product with a Price
     """
     
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+    # Loaded the first time an Item is created, rather than when this module is imported
+    tokenizer = None
     PREFIX = "Price is $"
     QUESTION = "How much does this cost to the nearest dollar?"
     REMOVALS = ['"Batteries Included?": "No"', '"Batteries Included?": "Yes"', '"Batteries Required?": "No"', '"Batteries Required?": "Yes"', "By Manufacturer", "Item", "Date First", "Package", ":", "Number of", "Best Sellers", "Number", "Product "]
@@ -26,6 +26,13 @@ class Item:
     prompt: Optional[str] = None
     include = False
 
+    @classmethod
+    def get_tokenizer(cls):
+        if cls.tokenizer is None:
+            from transformers import AutoTokenizer
+            cls.tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+        return cls.tokenizer
+
     def __init__(self, data, price):
         self.title = data['title']
         self.price = price
@@ -68,10 +75,10 @@ class Item:
         if len(contents) > MIN_CHARS:
             contents = contents[:CEILING_CHARS]
             text = f"{self.scrub(self.title)}\n{self.scrub(contents)}"
-            tokens = self.tokenizer.encode(text, add_special_tokens=False)
+            tokens = self.get_tokenizer().encode(text, add_special_tokens=False)
             if len(tokens) > MIN_TOKENS:
                 tokens = tokens[:MAX_TOKENS]
-                text = self.tokenizer.decode(tokens)
+                text = self.get_tokenizer().decode(tokens)
                 self.make_prompt(text)
                 self.include = True
 
@@ -81,7 +88,7 @@ class Item:
         """
         self.prompt = f"{self.QUESTION}\n\n{text}\n\n"
         self.prompt += f"{self.PREFIX}{str(round(self.price))}.00"
-        self.token_count = len(self.tokenizer.encode(self.prompt, add_special_tokens=False))
+        self.token_count = len(self.get_tokenizer().encode(self.prompt, add_special_tokens=False))
 
     def test_prompt(self):
         """
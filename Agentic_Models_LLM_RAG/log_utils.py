@@ -1,3 +1,9 @@
+import re
+import logging
+import threading
+from collections import deque
+from typing import List, Tuple
+
 # Foreground colors
 RED = '\033[31m'
 GREEN = '\033[32m'
@@ -25,11 +31,83 @@ mapper = {
     BG_BLUE+WHITE: "#ff7800"
 }
 
+# Every color code and the reset code, converted in a single pass of one precompiled regex
+replacements = {key: f'<span style="color: {value}">' for key, value in mapper.items()}
+replacements[RESET] = '</span>'
+pattern = re.compile('|'.join(re.escape(key) for key in sorted(replacements, key=len, reverse=True)))
+
 
 def reformat(message):
-    for key, value in mapper.items():
-        message = message.replace(key, f'<span style="color: {value}">')
-    message = message.replace(RESET, '</span>')
-    return message
+    return pattern.sub(lambda match: replacements[match.group(0)], message)
+
+
+class LogBuffer(logging.Handler):
+    """
+    A single logging handler for the whole process that keeps the most recent lines, already converted to HTML,
+    in a bounded ring buffer
+    Any number of UI sessions follow it, each with its own cursor, and are woken when there's something new
+    rather than polling
+    """
+
+    def __init__(self, capacity: int = 200):
+        """
+        :param capacity: how many of the most recent lines to keep
+        """
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S %z"))
+
+    def emit(self, record):
+        try:
+            line = reformat(self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        with self.condition:
+            self.sequence += 1
+            self.lines.append((self.sequence, line))
+            self.condition.notify_all()
+
+    def wake(self):
+        """
+        Wake every session that is waiting, for instance because there are new results to show
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def since(self, cursor: int) -> Tuple[List[str], int]:
+        with self.condition:
+            return [line for sequence, line in self.lines if sequence > cursor], self.sequence
+
+    def wait(self, cursor: int, timeout: float = 30.0) -> Tuple[List[str], int]:
+        """
+        Block until there are lines after the cursor, wake() is called, or the timeout passes
+        :param cursor: the sequence number of the last line this session has seen
+        :return: the lines after the cursor, and the new cursor
+        """
+        with self.condition:
+            if self.sequence == cursor:
+                self.condition.wait(timeout)
+            return [line for sequence, line in self.lines if sequence > cursor], self.sequence
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_log_buffer() -> LogBuffer:
+    """
+    Return the process-wide LogBuffer, attaching it to the root logger the first time
+    """
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = LogBuffer()
+            logger = logging.getLogger()
+            logger.addHandler(_buffer)
+            logger.setLevel(logging.INFO)
+        return _buffer
     
     
\ No newline at end of file
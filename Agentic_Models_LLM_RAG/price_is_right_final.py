@@ -1,46 +1,37 @@
-import logging
-import queue
-import threading
 import time
+from collections import deque
 import gradio as gr
-from deal_agent_framework import DealAgentFramework
+from deal_agent_framework import DealAgentFramework, DealScheduler
 from agents.deals import Opportunity, Deal
-from log_utils import reformat
+from log_utils import get_log_buffer
 import plotly.graph_objects as go
 
+LOG_LINES = 18
+# After waking for new log lines, wait this long for any more, so a burst of lines is rendered and sent once
+COALESCE_SECONDS = 0.25
 
-class QueueHandler(logging.Handler):
-    def __init__(self, log_queue):
-        super().__init__()
-        self.log_queue = log_queue
-
-    def emit(self, record):
-        self.log_queue.put(self.format(record))
 
 def html_for(log_data):
-    output = '<br>'.join(log_data[-18:])
+    output = '<br>'.join(log_data)
     return f"""
     <div id="scrollContent" style="height: 400px; overflow-y: auto; border: 1px solid #ccc; background-color: #222229; padding: 10px;">
     {output}
     </div>
     """
 
-def setup_logging(log_queue):
-    handler = QueueHandler(log_queue)
-    formatter = logging.Formatter(
-        "[%(asctime)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S %z",
-    )
-    handler.setFormatter(formatter)
-    logger = logging.getLogger()
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-                
+def table_for(opps):
+    return [[opp.deal.product_description, f"${opp.deal.price:.2f}", f"${opp.estimate:.2f}", f"${opp.discount:.2f}", opp.deal.url] for opp in opps]
+
 
 class App:
 
     def __init__(self):    
         self.agent_framework = None
+        self.scheduler = None
+        self.log_buffer = get_log_buffer()
+        # The table of opportunities after the latest run, shared by every session, and a counter of the runs that changed it
+        self.results = None
+        self.results_version = 0
 
     def get_agent_framework(self):
         if not self.agent_framework:
@@ -48,30 +39,25 @@ class App:
             self.agent_framework.init_agents_as_needed()
         return self.agent_framework
 
+    def get_scheduler(self):
+        """
+        The single scheduler that runs the Agent Framework for every browser session, started the first time it's needed
+        """
+        if not self.scheduler:
+            self.scheduler = DealScheduler(self.get_agent_framework())
+            self.scheduler.subscribe(self.publish)
+        return self.scheduler.start()
+
+    def publish(self, memory):
+        """
+        Called by the scheduler after each run: build the table once for all sessions and wake them
+        """
+        self.results = table_for(memory)
+        self.results_version += 1
+        self.log_buffer.wake()
+
     def run(self):
         with gr.Blocks(title="The Price is Right", fill_width=True) as ui:
-            
-            log_data = gr.State([])
-            
-            def table_for(opps):
-                return [[opp.deal.product_description, f"${opp.deal.price:.2f}", f"${opp.estimate:.2f}", f"${opp.discount:.2f}", opp.deal.url] for opp in opps]
-
-            def update_output(log_data, log_queue, result_queue):
-                initial_result = table_for(self.get_agent_framework().memory)
-                final_result = None
-                while True:
-                    try:
-                        message = log_queue.get_nowait()
-                        log_data.append(reformat(message))
-                        yield log_data, html_for(log_data), final_result or initial_result
-                    except queue.Empty:
-                        try:
-                            final_result = result_queue.get_nowait()
-                            yield log_data, html_for(log_data), final_result or initial_result
-                        except queue.Empty:
-                            if final_result is not None:
-                                break
-                            time.sleep(0.1)
 
             def get_initial_plot():
                 fig = go.Figure()
@@ -107,25 +93,36 @@ class App:
 
                 return fig
         
-            def do_run():
-                new_opportunities = self.get_agent_framework().run()
-                table = table_for(new_opportunities)
-                return table
-
-            def run_with_logging(initial_log_data):
-                log_queue = queue.Queue()
-                result_queue = queue.Queue()
-                setup_logging(log_queue)
-                
-                def worker():
-                    result = do_run()
-                    result_queue.put(result)
-                
-                thread = threading.Thread(target=worker)
-                thread.start()
-                
-                for log_data, output, final_result in update_output(initial_log_data, log_queue, result_queue):
-                    yield log_data, output, final_result
+            def follow_scheduler():
+                """
+                Stream the logs and the results of the scheduler's runs to this browser session
+                The scheduler does the runs, so opening more sessions doesn't start more runs
+                Each update is sent only when there are new log lines or new results, and only for the output that changed;
+                the HTML component is replaced whole, so lines arriving together are gathered into one update
+                When the wait times out with nothing new, an empty update is yielded, which is how Gradio finds out
+                that the browser session has gone and stops this generator
+                """
+                log_data = deque(maxlen=LOG_LINES)
+                lines, cursor = self.log_buffer.since(0)
+                log_data.extend(lines)
+                self.get_scheduler()
+                version = self.results_version
+                table = self.results if self.results is not None else table_for(self.get_agent_framework().memory)
+                yield html_for(log_data), table
+                while True:
+                    lines, cursor = self.log_buffer.wait(cursor)
+                    if lines:
+                        time.sleep(COALESCE_SECONDS)
+                        more, cursor = self.log_buffer.since(cursor)
+                        lines += more
+                    changed = version != self.results_version
+                    if not lines and not changed:
+                        yield gr.update(), gr.update()
+                        continue
+                    log_data.extend(lines)
+                    if changed:
+                        version = self.results_version
+                    yield html_for(log_data) if lines else gr.update(), self.results if changed else gr.update()
 
             def do_select(selected_index: gr.SelectData):
                 opportunities = self.get_agent_framework().memory
@@ -152,10 +149,9 @@ class App:
                 with gr.Column(scale=1):
                     plot = gr.Plot(value=get_plot(), show_label=False)
         
-            ui.load(run_with_logging, inputs=[log_data], outputs=[log_data, logs, opportunities_dataframe])
-
-            timer = gr.Timer(value=300, active=True)
-            timer.tick(run_with_logging, inputs=[log_data], outputs=[log_data, logs, opportunities_dataframe])
+            # follow_scheduler never returns, so lift Gradio's default limit of one concurrent run per event,
+            # which would leave every session after the first waiting in the queue
+            ui.load(follow_scheduler, outputs=[logs, opportunities_dataframe], concurrency_limit=None)
 
             opportunities_dataframe.select(do_select)
         
@@ -0,0 +1,296 @@
+import os
+import re
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional, List, Tuple, Callable, Any
+
+# Constants
+
+BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
+PROJECT_NAME = "pricer"
+HF_USER = "shreshre"
+RUN_NAME = "2025-10-08_13.04.39"
+PROJECT_RUN_NAME = f"{PROJECT_NAME}-{RUN_NAME}"
+REVISION = "e8d635df551603dc86cd7a1598a8f44af4d7ae23"
+FINETUNED_MODEL = f"{HF_USER}/{PROJECT_RUN_NAME}"
+
+# A tiny causal LM with the same architecture as Llama, used to exercise the service on a CPU without a GPU or HF secret
+LOCAL_TEST_MODEL = "hf-internal-testing/tiny-random-LlamaForCausalLM"
+
+
+class PricerModel:
+    """
+    The fine-tuned pricing model, independent of where it runs
+    The tokenizer and model are loaded once by load() and then reused for every call to price(),
+    so that a long-lived container (Modal) or process (local testing) only pays the load cost once
+    """
+
+    QUESTION = "How much does this cost to the nearest dollar?"
+    PREFIX = "Price is $"
+    MAX_NEW_TOKENS = 5
+    MAX_BATCH_SIZE = 16
+
+    # Decoding modes: "generate" runs generate and parses the text, while "expected" and "argmax"
+    # read the price from the next-token distribution after the PREFIX in a single forward pass
+    DECODING_MODES = ("generate", "expected", "argmax")
+    # Below this probability on the most likely price token, a logits estimate falls back to generate
+    MIN_CONFIDENCE = 0.05
+
+    def __init__(self, base_model: str = BASE_MODEL, finetuned_model: Optional[str] = FINETUNED_MODEL,
+                 revision: Optional[str] = REVISION, quantize: Optional[bool] = None, device: Optional[str] = None,
+                 decoding: str = "generate"):
+        """
+        :param base_model: the HuggingFace name of the base model
+        :param finetuned_model: the HuggingFace name of the PEFT adapter, or None to use the base model alone
+        :param revision: the revision of the PEFT adapter
+        :param quantize: load the base model in 4 bit; defaults to True when a GPU is available
+        :param device: "cuda" or "cpu"; defaults to cuda when available
+        :param decoding: one of DECODING_MODES
+        """
+        if decoding not in self.DECODING_MODES:
+            raise ValueError(f"decoding must be one of {self.DECODING_MODES}, not {decoding!r}")
+        self.base_model = base_model
+        self.finetuned_model = finetuned_model
+        self.revision = revision
+        self.quantize = quantize
+        self.device = device
+        self.decoding = decoding
+        self.tokenizer = None
+        self.model = None
+        self.price_token_ids = None
+        self.price_token_values = None
+        # The batcher thread and direct price_batch calls can arrive together; only one may use the GPU at a time
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_local_testing(cls, base_model: str = LOCAL_TEST_MODEL, decoding: str = "generate"):
+        """
+        Create a PricerModel that runs a tiny model on the CPU, with no adapter and no quantization
+        """
+        return cls(base_model=base_model, finetuned_model=None, revision=None, quantize=False, device="cpu", decoding=decoding)
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.model is not None
+
+    def load(self):
+        """
+        Load the tokenizer, the (optionally quantized) base model and the PEFT adapter
+        Calling this again once loaded does nothing
+        """
+        if self.is_loaded:
+            return self
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, set_seed
+
+        if self.device is None:
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if self.quantize is None:
+            self.quantize = self.device == "cuda"
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.base_model)
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Left padding so that every prompt in a batch ends right where generation begins
+        self.tokenizer.padding_side = "left"
+
+        if self.quantize:
+            quant_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_compute_dtype=torch.bfloat16,
+                bnb_4bit_quant_type="nf4"
+            )
+            model = AutoModelForCausalLM.from_pretrained(self.base_model, quantization_config=quant_config, device_map="auto")
+        else:
+            model = AutoModelForCausalLM.from_pretrained(self.base_model).to(self.device)
+
+        if self.finetuned_model:
+            from peft import PeftModel
+            model = PeftModel.from_pretrained(model, self.finetuned_model, revision=self.revision)
+
+        model.eval()
+        self.model = model
+        self._index_price_tokens()
+        set_seed(42)
+        return self
+
+    def _index_price_tokens(self):
+        """
+        Find every vocabulary token that is a bare number, like "7" or "129", and remember its value
+        The Llama 3 tokenizer has a single token for each number up to 999, which covers the prices we trained on
+        """
+        import torch
+
+        ids, values = [], []
+        for token_id in range(len(self.tokenizer)):
+            text = self.tokenizer.decode([token_id])
+            if text.isascii() and text.isdigit():
+                ids.append(token_id)
+                values.append(float(text))
+        self.price_token_ids = torch.tensor(ids, dtype=torch.long, device=self.device)
+        self.price_token_values = torch.tensor(values, dtype=torch.float32, device=self.device)
+
+    def make_prompt(self, description: str) -> str:
+        """
+        Create the prompt in the same format that the model was fine-tuned on
+        """
+        return f"{self.QUESTION}\n{description}\n{self.PREFIX}"
+
+    def parse_price(self, text: str) -> float:
+        """
+        Pluck the price out of the decoded model output
+        """
+        contents = text.split(self.PREFIX)[-1]
+        contents = contents.replace(',', '')
+        match = re.search(r"[-+]?\d*\.\d+|\d+", contents)
+        return float(match.group()) if match else 0.0
+
+    def price(self, description: str) -> float:
+        """
+        Estimate the price of the described product
+        :param description: a description of the product
+        :return: an estimate of its price
+        """
+        return self.price_batch([description])[0]
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of many products, running one batched pass per MAX_BATCH_SIZE descriptions
+        :param descriptions: descriptions of the products
+        :return: an estimate of the price of each, in the same order
+        """
+        if self.decoding == "generate":
+            return self._in_batches(self._generate_batch, descriptions)
+        return [price for price, _ in self.price_with_confidence_batch(descriptions)]
+
+    def price_with_confidence_batch(self, descriptions: List[str]) -> List[Tuple[float, float]]:
+        """
+        Estimate prices from the next-token distribution, falling back to generate for low confidence estimates
+        :param descriptions: descriptions of the products
+        :return: a (price, confidence) tuple for each description, where confidence is the probability of the most likely price token
+        """
+        estimates = self._in_batches(self._logits_batch, descriptions)
+        unsure = [i for i, (_, confidence) in enumerate(estimates) if confidence < self.MIN_CONFIDENCE]
+        if unsure:
+            fallbacks = self._in_batches(self._generate_batch, [descriptions[i] for i in unsure])
+            for i, price in zip(unsure, fallbacks):
+                estimates[i] = (price, estimates[i][1])
+        return estimates
+
+    def _in_batches(self, batch_fn: Callable[[List[str]], List], descriptions: List[str]) -> List:
+        results = []
+        for start in range(0, len(descriptions), self.MAX_BATCH_SIZE):
+            results.extend(batch_fn(descriptions[start:start + self.MAX_BATCH_SIZE]))
+        return results
+
+    def _tokenize(self, descriptions: List[str]):
+        self.load()
+        prompts = [self.make_prompt(description) for description in descriptions]
+        return self.tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=True).to(self.device)
+
+    def _logits_batch(self, descriptions: List[str]) -> List[Tuple[float, float]]:
+        """
+        Run a single forward pass over the left-padded prompts and read the distribution over price tokens
+        at the position right after the PREFIX
+        """
+        import torch
+
+        inputs = self._tokenize(descriptions)
+        # With left padding, positions have to be counted from each prompt's first real token
+        position_ids = (inputs["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+        with self.lock, torch.no_grad():
+            logits = self.model(**inputs, position_ids=position_ids).logits[:, -1, :]
+        probabilities = torch.softmax(logits.float(), dim=-1)[:, self.price_token_ids]
+        best = probabilities.argmax(dim=-1)
+        confidences = probabilities.gather(1, best.unsqueeze(1)).squeeze(1)
+        if self.decoding == "argmax":
+            prices = self.price_token_values[best]
+        else:
+            prices = (probabilities * self.price_token_values).sum(dim=-1) / probabilities.sum(dim=-1)
+        return list(zip(prices.tolist(), confidences.tolist()))
+
+    def _generate_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Left-pad the prompts, run a single generate over all of them and parse each continuation
+        """
+        import torch
+
+        inputs = self._tokenize(descriptions)
+        with self.lock, torch.no_grad():
+            outputs = self.model.generate(**inputs, max_new_tokens=self.MAX_NEW_TOKENS, num_return_sequences=1,
+                                          pad_token_id=self.tokenizer.pad_token_id)
+        continuations = self.tokenizer.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        return [self.parse_price(continuation) for continuation in continuations]
+
+
+class DynamicBatcher:
+    """
+    Collects requests that arrive concurrently from many threads, and hands them to a batch function together
+    A batch is run as soon as it holds max_batch_size requests, or max_wait_ms after its first request arrived
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 16, max_wait_ms: float = 10):
+        """
+        :param batch_fn: a function that takes a list of inputs and returns a list of results in the same order
+        :param max_batch_size: the largest number of inputs passed to batch_fn at once
+        :param max_wait_ms: how long to wait for more inputs once the first one has arrived
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, item: Any) -> Any:
+        """
+        Add this input to the next batch, block until that batch has run and return this input's result
+        """
+        future = Future()
+        self.requests.put((item, future))
+        return future.result()
+
+    def _collect(self) -> List:
+        """
+        Block for the first request, then gather more until the batch is full or the wait is over
+        """
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.batch_fn(items))
+                if len(results) != len(batch):
+                    raise ValueError(f"batch_fn returned {len(results)} results for {len(batch)} inputs")
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                # Every caller in the batch is blocked on its future, so none may be left unresolved
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+if __name__ == "__main__":
+    # Run the pricer locally on the CPU against a tiny model, to check the plumbing without a GPU:
+    # python pricer_model.py "Quadcast HyperX condenser mic"
+    import sys
+    description = " ".join(sys.argv[1:]) or "Quadcast HyperX condenser mic, connects via usb-c to your computer for crystal clear audio"
+    pricer = PricerModel.for_local_testing(os.getenv("PRICER_LOCAL_MODEL", LOCAL_TEST_MODEL))
+    print(pricer.price(description))
+    print(pricer.price_batch([description, "iPad Pro 2nd generation"]))
+    pricer.decoding = "expected"
+    print(pricer.price_with_confidence_batch([description, "iPad Pro 2nd generation"]))
@@ -1,69 +1,59 @@
 import modal
-from modal import App, Image
+from modal import App, Image, Volume
 
 # Setup - define our infrastructure with code!
 
 app = modal.App("pricer-service")
-image = Image.debian_slim().pip_install("torch", "transformers", "bitsandbytes", "accelerate", "peft")
+
+# pricer_model.py holds the model code, so that it can also be run and tested locally without Modal
+image = Image.debian_slim().pip_install("torch", "transformers", "bitsandbytes", "accelerate", "peft").add_local_python_source("pricer_model")
 
 # This collects the secret from Modal.
 # Depending on your Modal configuration, you may need to replace "hf-secret" with "huggingface-secret"
 secrets = [modal.Secret.from_name("hf-secret")]
 
+# Keep the HuggingFace downloads on a Volume so that a new container doesn't download the weights again
+CACHE_DIR = "/cache"
+hf_cache_volume = Volume.from_name("hf-hub-cache", create_if_missing=True)
+
 # Constants
 
 GPU = "T4"
-BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
-PROJECT_NAME = "pricer"
-HF_USER = "shreshre" 
-RUN_NAME = "2025-10-08_13.04.39"
-PROJECT_RUN_NAME = f"{PROJECT_NAME}-{RUN_NAME}"
-REVISION = "e8d635df551603dc86cd7a1598a8f44af4d7ae23"
-FINETUNED_MODEL = f"{HF_USER}/{PROJECT_RUN_NAME}"
-
-
-@app.function(image=image, secrets=secrets, gpu=GPU, timeout=1800)
-def price(description: str) -> float:
-    import os
-    import re
-    import torch
-    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, set_seed
-    from peft import PeftModel
-
-    QUESTION = "How much does this cost to the nearest dollar?"
-    PREFIX = "Price is $"
-
-    prompt = f"{QUESTION}\n{description}\n{PREFIX}"
-    
-    # Quant Config
-    quant_config = BitsAndBytesConfig(
-        load_in_4bit=True,
-        bnb_4bit_use_double_quant=True,
-        bnb_4bit_compute_dtype=torch.bfloat16,
-        bnb_4bit_quant_type="nf4"
-    )
-
-    # Load model and tokenizer
-    
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-    tokenizer.pad_token = tokenizer.eos_token
-    tokenizer.padding_side = "right"
-    
-    base_model = AutoModelForCausalLM.from_pretrained(
-        BASE_MODEL, 
-        quantization_config=quant_config,
-        device_map="auto"
-    )
-
-    fine_tuned_model = PeftModel.from_pretrained(base_model, FINETUNED_MODEL, revision=REVISION)
-
-    set_seed(42)
-    inputs = tokenizer.encode(prompt, return_tensors="pt").to("cuda")
-    attention_mask = torch.ones(inputs.shape, device="cuda")
-    outputs = fine_tuned_model.generate(inputs, attention_mask=attention_mask, max_new_tokens=5, num_return_sequences=1)
-    result = tokenizer.decode(outputs[0])
-
-    contents = result.split("Price is $")[1]
-    contents = contents.replace(',','')
-    match = re.search(r"[-+]?\d*\.\d+|\d+", contents)
-    return float(match.group()) if match else 0
+MIN_CONTAINERS = 0
+MAX_BATCH_SIZE = 16
+MAX_WAIT_MS = 10
+# "generate" parses the generated text; "expected" or "argmax" read the price from a single forward pass (see PricerModel)
+DECODING = "generate"
+
+
+@app.cls(image=image, secrets=secrets, gpu=GPU, timeout=1800, min_containers=MIN_CONTAINERS,
+         volumes={CACHE_DIR: hf_cache_volume}, env={"HF_HUB_CACHE": CACHE_DIR})
+@modal.concurrent(max_inputs=MAX_BATCH_SIZE)
+class Pricer:
+    """
+    The fine-tuned pricer as a Modal class
+    The model is loaded once when a container starts, and reused for every request that container serves
+    Concurrent calls to price() are micro-batched by a DynamicBatcher into a single generate
+    """
+
+    @modal.enter()
+    def setup(self):
+        from pricer_model import PricerModel, DynamicBatcher
+        self.pricer = PricerModel(decoding=DECODING).load()
+        self.batcher = DynamicBatcher(self.pricer.price_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS)
+
+    @modal.method()
+    def price(self, description: str) -> float:
+        return self.batcher.submit(description)
+
+    @modal.method()
+    def price_batch(self, descriptions: list[str]) -> list[float]:
+        return self.pricer.price_batch(descriptions)
+
+    @modal.method()
+    def price_with_confidence_batch(self, descriptions: list[str]) -> list[tuple[float, float]]:
+        return self.pricer.price_with_confidence_batch(descriptions)
+
+    @modal.method()
+    def wake_up(self) -> str:
+        return "ok"
@@ -0,0 +1,59 @@
+"""
+Profile the startup of the Agent Framework: the time to import each library and module, to initialize each Agent,
+and optionally to the first deal that the Scanner Agent selects
+
+    python profile_startup.py
+    python profile_startup.py --scan
+
+Imports are timed in the order listed, so each time is what that import adds on top of the ones before it
+--scan makes a real, paid, call to OpenAI; the deals it scans are marked as seen only in a temporary copy of
+seen_urls.txt, so they are still new to the next real run
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+
+from agents.startup import profile
+from agents.seen_urls import SeenUrls
+
+IMPORTS = [
+    "numpy", "pydantic", "openai", "httpx", "feedparser", "bs4", "joblib", "sklearn.linear_model",
+    "chromadb", "modal", "sentence_transformers",
+    "agents.deals", "agents.scanner_agent", "agents.frontier_agent", "agents.random_forest_agent",
+    "agents.specialist_agent", "agents.ensemble_agent", "agents.messaging_agent", "agents.planning_agent",
+    "deal_agent_framework",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the startup of the Agent Framework")
+    parser.add_argument("--scan", action="store_true", help="also time the first deal selected by the Scanner Agent; this calls OpenAI, "
+                        "with a throwaway copy of the seen URLs")
+    parser.add_argument("--imports", action="store_true", help="time each import separately before starting the framework")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.imports:
+        for module in IMPORTS:
+            profile.timed("import", module, importlib.import_module, module)
+    from deal_agent_framework import DealAgentFramework
+    framework = profile.timed("framework", "DealAgentFramework()", DealAgentFramework)
+    profile.timed("framework", "init_agents_as_needed()", framework.init_agents_as_needed)
+    ready = time.perf_counter() - start
+    if args.scan:
+        scanner = framework.planner.scanner
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, SeenUrls.FILENAME)
+            if os.path.exists(scanner.seen.path):
+                shutil.copyfile(scanner.seen.path, path)
+            scanner.seen = SeenUrls(path)
+            deals = scanner.scan_stream(memory=framework.memory)
+            profile.timed("framework", "first deal from the scanner", next, deals, None)
+            deals.close()
+
+    print(profile.report())
+    print(f"Ready to scan after {ready:.2f}s; total {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,133 @@
+import os
+from typing import List, Tuple
+import numpy as np
+
+
+class VectorProjection:
+    """
+    A TSNE projection of the products in the Chroma datastore, computed once and saved next to it in a .npz file
+    with the ids, documents, categories and original vectors of the projected products
+
+    The file records the version of the products collection it was computed from, taken from its count and its last id,
+    so while the products are unchanged, loading the projection is a cheap check and reading the file
+    Other collections in the same datastore, such as the live deals written on every run, don't change the version
+    When products have been added, they are placed by kNN interpolation: each new product goes at the distance-weighted mean
+    of the projected positions of its nearest neighbours among the products already projected
+    Once more than REFIT_FRACTION of the products were placed that way, the projection is computed again from scratch
+    """
+
+    NEIGHBORS = 5
+    REFIT_FRACTION = 0.2
+
+    def __init__(self, db: str = "products_vectorstore", max_datapoints: int = 1000, n_components: int = 3):
+        """
+        :param db: the directory of the Chroma datastore
+        :param max_datapoints: how many products to project
+        :param n_components: 2 or 3 dimensions
+        """
+        self.db = db
+        self.max_datapoints = max_datapoints
+        self.n_components = n_components
+        self.path = f"{db}_tsne{n_components}d_{max_datapoints}.npz"
+
+    @staticmethod
+    def store_version(collection) -> str:
+        """
+        A cheap fingerprint of the products collection, that changes whenever products are added or removed
+        """
+        count = collection.count()
+        last = collection.get(include=[], limit=1, offset=count - 1)['ids'] if count else []
+        return f"{count}:{last[0] if last else ''}"
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with np.load(self.path, allow_pickle=False) as data:
+            return {key: data[key] for key in data.files}
+
+    def save(self, data: dict):
+        temporary = self.path + ".tmp.npz"
+        np.savez(temporary, **data)
+        os.replace(temporary, self.path)
+
+    def collection(self):
+        import chromadb
+        client = chromadb.PersistentClient(path=self.db)
+        return client.get_or_create_collection('products')
+
+    def fit(self, collection) -> dict:
+        """
+        Project the products from scratch with TSNE
+        """
+        from sklearn.manifold import TSNE
+        result = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=self.max_datapoints)
+        vectors = np.array(result['embeddings'], dtype=np.float32)
+        tsne = TSNE(n_components=self.n_components, random_state=42, n_jobs=-1)
+        coordinates = tsne.fit_transform(vectors)
+        return {
+            "version": np.array(self.store_version(collection)),
+            "ids": np.array(result['ids']),
+            "documents": np.array(result['documents']),
+            "categories": np.array([metadata['category'] for metadata in result['metadatas']]),
+            "vectors": vectors,
+            "coordinates": coordinates.astype(np.float32),
+            "interpolated": np.zeros(len(result['ids']), dtype=bool),
+        }
+
+    @classmethod
+    def interpolate(cls, vectors: np.ndarray, coordinates: np.ndarray, new_vectors: np.ndarray) -> np.ndarray:
+        """
+        Place new vectors at the inverse-distance weighted mean of the coordinates of their nearest neighbours
+        :param vectors: the vectors that have already been projected
+        :param coordinates: their projected coordinates
+        :param new_vectors: the vectors to place
+        :return: coordinates for the new vectors
+        """
+        k = min(cls.NEIGHBORS, len(vectors))
+        distances = np.sqrt(np.maximum(
+            (new_vectors ** 2).sum(axis=1)[:, None] - 2 * new_vectors @ vectors.T + (vectors ** 2).sum(axis=1)[None, :], 0))
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        weights = 1.0 / (np.take_along_axis(distances, nearest, axis=1) + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return (coordinates[nearest] * weights[:, :, None]).sum(axis=1).astype(np.float32)
+
+    def extend(self, data: dict, collection) -> dict:
+        """
+        Bring a saved projection up to date with the datastore, interpolating any products added since it was saved
+        """
+        ids = collection.get(include=[], limit=self.max_datapoints)['ids']
+        known = set(data['ids'].tolist())
+        new_ids = [id for id in ids if id not in known]
+        if new_ids:
+            result = collection.get(ids=new_ids, include=['embeddings', 'documents', 'metadatas'])
+            new_vectors = np.array(result['embeddings'], dtype=np.float32)
+            new_coordinates = self.interpolate(data['vectors'], data['coordinates'], new_vectors)
+            data = {
+                **data,
+                "ids": np.concatenate([data['ids'], np.array(result['ids'])]),
+                "documents": np.concatenate([data['documents'], np.array(result['documents'])]),
+                "categories": np.concatenate([data['categories'], np.array([m['category'] for m in result['metadatas']])]),
+                "vectors": np.concatenate([data['vectors'], new_vectors]),
+                "coordinates": np.concatenate([data['coordinates'], new_coordinates]),
+                "interpolated": np.concatenate([data['interpolated'], np.ones(len(result['ids']), dtype=bool)]),
+            }
+        # Keep just the products that the datastore returns now, in its order
+        index = {id: i for i, id in enumerate(data['ids'].tolist())}
+        rows = np.array([index[id] for id in ids if id in index], dtype=int)
+        data = {key: value if key == 'version' else value[rows] for key, value in data.items()}
+        if data['interpolated'].sum() > self.REFIT_FRACTION * len(rows):
+            return self.fit(collection)
+        data['version'] = np.array(self.store_version(collection))
+        return data
+
+    def get(self) -> Tuple[List[str], np.ndarray, List[str]]:
+        """
+        The projection of the current datastore: read from the file if it's up to date, otherwise updated and saved
+        :return: the documents, their projected coordinates, and their categories
+        """
+        data = self.load()
+        collection = self.collection()
+        if not data or str(data['version']) != self.store_version(collection):
+            data = self.extend(data, collection) if data else self.fit(collection)
+            self.save(data)
+        return data['documents'].tolist(), data['coordinates'], data['categories'].tolist()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests import the agents package the same way the notebooks and scripts do, from the project directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,31 @@
+"""
+The targeted extraction in agents/extraction.py, on the fixture pages in fixtures/pages and an expired-deal page
+
+    python -m pytest tests
+"""
+
+import os
+import glob
+
+import pytest
+
+from agents.extraction import extract_details
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+PAGES = os.path.join(FIXTURES, "pages")
+
+
+def test_extracts_details_and_features_from_fixture_pages():
+    paths = sorted(glob.glob(os.path.join(PAGES, "*.html")))
+    assert paths
+    for path in paths:
+        with open(path, "rb") as file:
+            details, features = extract_details(file.read())
+        assert details.strip()
+        assert "Popular Deals" not in details + features
+
+
+def test_page_without_content_section_raises():
+    with open(os.path.join(FIXTURES, "no_content_section.html"), "rb") as file:
+        with pytest.raises(ValueError):
+            extract_details(file.read())
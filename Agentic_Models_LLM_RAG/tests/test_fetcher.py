@@ -0,0 +1,136 @@
+"""
+AsyncDealFetcher against a local fixture HTTP server, serving an RSS feed and the detail pages of its deals
+
+    python -m pytest tests
+"""
+
+import asyncio
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import Counter
+
+import pytest
+
+from agents.fetcher import AsyncDealFetcher
+from agents.http_cache import HttpCache
+
+PAGES = {
+    "/deal/1": b'<html><body><nav>Menu</nav><div class="content-section"><p>A 55-inch 4K television</p>'
+               b'Features<ul><li>HDR10</li></ul></div><footer>Footer</footer></body></html>',
+    "/deal/2": b'<html><body><div class="content-section"><p>A cordless drill</p></div></body></html>',
+    "/deal/3": b'<html><body><div class="content-section"><p>A robot vacuum</p>'
+               b'Features<ul><li>Self-emptying</li></ul></div></body></html>',
+}
+# Paths that answer 503 Service Unavailable the first time they're requested
+FLAKY = {"/deal/3"}
+
+
+def feed_for(base: str) -> bytes:
+    items = "".join(
+        f"<item><title>Deal {path[-1]}</title><link>{base}{path}</link>"
+        f"<description>&lt;div class=\"snippet summary\"&gt;Summary of deal {path[-1]}&lt;/div&gt;</description></item>"
+        for path in PAGES)
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Deals</title>{items}</channel></rss>'.encode("utf-8")
+
+
+class FixtureServer:
+    """
+    Serves the feed and the pages on localhost with ETags, answering 304 to a matching If-None-Match,
+    and counts the requests and the 304s for each path
+    """
+
+    def __init__(self):
+        self.requests = Counter()
+        self.not_modified = Counter()
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fixture.requests[self.path] += 1
+                if self.path in FLAKY and fixture.requests[self.path] == 1:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = feed_for(fixture.base) if self.path == "/feed.xml" else PAGES.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    fixture.not_modified[self.path] += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FixtureServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    with FixtureServer() as fixture:
+        yield fixture
+
+
+def make_fetcher(server: FixtureServer, cache=None) -> AsyncDealFetcher:
+    return AsyncDealFetcher(feed_urls=[server.base + "/feed.xml"], rate_per_host=1000, burst=10,
+                            timeout=5, retries=2, backoff=0.01, cache=cache)
+
+
+def test_fetch_parses_deals_skips_known_urls_and_retries_503(server):
+    fetcher = make_fetcher(server)
+    deals = asyncio.run(fetcher.fetch(skip_urls={server.base + "/deal/2"}))
+
+    assert [deal.title for deal in deals] == ["Deal 1", "Deal 3"]
+    assert deals[0].url == server.base + "/deal/1"
+    assert deals[0].summary == "Summary of deal 1"
+    assert deals[0].details.strip() == "A 55-inch 4K television"
+    assert deals[0].features.strip() == "HDR10"
+    assert deals[1].features.strip() == "Self-emptying"
+    assert fetcher.failures == 0
+    assert server.requests["/deal/2"] == 0
+    assert server.requests["/deal/3"] == 2
+
+
+def test_failed_feed_is_logged_and_counted(server, caplog):
+    fetcher = make_fetcher(server)
+    fetcher.feed_urls = [server.base + "/missing.xml", server.base + "/feed.xml"]
+    deals = asyncio.run(fetcher.fetch())
+
+    assert [deal.title for deal in deals] == ["Deal 1", "Deal 2", "Deal 3"]
+    assert fetcher.feed_failures == 1
+    assert server.base + "/missing.xml" in caplog.text
+
+
+def test_cache_makes_conditional_requests_and_serves_304s(server, tmp_path):
+    cache = HttpCache(str(tmp_path / "http_cache.db"))
+    first = asyncio.run(make_fetcher(server, cache).fetch())
+    assert [deal.title for deal in first] == ["Deal 1", "Deal 2", "Deal 3"]
+    assert sum(server.not_modified.values()) == 0
+
+    fetcher = make_fetcher(server, cache)
+    second = asyncio.run(fetcher.fetch())
+    assert [deal.title for deal in second] == [deal.title for deal in first]
+    assert [(deal.details, deal.features) for deal in second] == [(deal.details, deal.features) for deal in first]
+    assert fetcher.not_modified == 1 + len(PAGES)
+    assert server.not_modified == Counter({"/feed.xml": 1, **{path: 1 for path in PAGES}})